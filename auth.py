@@ -0,0 +1,185 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from storage import FileLock, file_identity, load_data, save_data
+
+# scrypt work factor for new password hashes (must be a power of two).  Each
+# doubling roughly doubles the time and memory one hash takes; existing hashes
+# keep the cost they were created with.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Secret for signing session tokens.  Set TASK_TOKEN_SECRET so tokens survive
+# restarts and are accepted by every worker; otherwise a random one is used.
+TOKEN_SECRET = os.environ.get("TASK_TOKEN_SECRET", "").encode() or secrets.token_bytes(32)
+TOKEN_TTL = 900
+
+
+# Password hashing
+def hash_password(password, n=None):
+    """Return a salted scrypt hash of ``password`` as ``scrypt$n$r$p$salt$hash``."""
+    n = n or SCRYPT_N
+    salt = secrets.token_bytes(16)
+    derived = hashlib.scrypt(password.encode(), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return "$".join(["scrypt", str(n), str(SCRYPT_R), str(SCRYPT_P), _b64encode(salt), _b64encode(derived)])
+
+def is_password_hash(stored):
+    return isinstance(stored, str) and stored.startswith("scrypt$")
+
+def verify_password(stored, password):
+    """Check ``password`` against a stored hash.
+
+    Entries that are not hashes yet are plaintext from before the migration and
+    are compared directly, so the service keeps working until users.json has
+    been migrated (see ``migrate_users_file``).
+    """
+    if not isinstance(stored, str) or not isinstance(password, str):
+        return False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        derived = hashlib.scrypt(
+            password.encode(), salt=_b64decode(salt), n=int(n), r=int(r), p=int(p), dklen=len(_b64decode(expected))
+        )
+    except ValueError:
+        return False
+    return hmac.compare_digest(derived, _b64decode(expected))
+
+def migrate_users_file(users_file):
+    """Hash every plaintext password in ``users_file`` in place; return how many were converted."""
+    # Under the file lock, so a user registered by the desktop app meanwhile is not lost
+    with FileLock(users_file):
+        users = load_data(users_file)
+        migrated = 0
+        for username, stored in users.items():
+            if not is_password_hash(stored):
+                users[username] = hash_password(stored)
+                migrated += 1
+        if migrated:
+            # save_data swaps in a complete new file, so a crash never leaves a half-migrated users.json
+            save_data(users_file, users)
+    return migrated
+
+
+# Session tokens
+def issue_token(username, ttl=None):
+    """Return a signed token proving ``username`` logged in, valid for ``ttl`` seconds."""
+    payload = _b64encode(json.dumps({"u": username, "exp": int(time.time()) + (ttl or TOKEN_TTL)}).encode())
+    return payload + "." + _b64encode(_sign(payload))
+
+def verify_token(token):
+    """Return the username a valid, unexpired token was issued to, else None.
+
+    This is a single HMAC computation: no file access and no password hashing.
+    """
+    if not isinstance(token, str) or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    try:
+        if not hmac.compare_digest(_b64decode(signature), _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims.get("u")
+
+def _sign(payload):
+    return hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest()
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class AuthCache:
+    """Resident copy of the users file plus a cache of recent successful logins.
+
+    The user table is reloaded only when the file's identity (inode, mtime,
+    size) changes or ``invalidate()`` is called.  Successful credential checks
+    are remembered for ``ttl`` seconds in an LRU of at most ``max_entries``
+    entries, so repeated calls from the same client touch neither the disk nor
+    the user table, and pay for the password hash only once.  Cache keys are
+    keyed digests, never the raw password.
+    """
+
+    def __init__(self, users_file, ttl=300, max_entries=1024):
+        self.users_file = users_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._users = None
+        self._file_identity = None
+        self._verified = OrderedDict()  # credential digest -> expiry time
+        self._digest_key = secrets.token_bytes(32)
+
+    def verify(self, username, password):
+        """Return True if ``username`` exists and ``password`` matches."""
+        if not isinstance(username, str) or not isinstance(password, str):
+            return False
+        digest = self._credential_digest(username, password)
+        now = time.monotonic()
+        with self._lock:
+            expiry = self._verified.get(digest)
+            if expiry is not None:
+                if expiry > now:
+                    self._verified.move_to_end(digest)
+                    return True
+                del self._verified[digest]
+            stored = self._current_users().get(username)
+        # Hash outside the lock so one slow check does not hold up every other request
+        if not verify_password(stored, password):
+            return False
+        with self._lock:
+            self._verified[digest] = now + self.ttl
+            if len(self._verified) > self.max_entries:
+                self._verified.popitem(last=False)
+        return True
+
+    def users(self):
+        """Return the current user table (reloaded if the file changed)."""
+        with self._lock:
+            return dict(self._current_users())
+
+    def invalidate(self):
+        """Drop the user table and every cached credential check."""
+        with self._lock:
+            self._users = None
+            self._file_identity = None
+            self._verified.clear()
+
+    def _current_users(self):
+        identity = file_identity(self.users_file)
+        if self._users is None or identity != self._file_identity:
+            self._users = load_data(self.users_file)
+            self._file_identity = identity
+            # Passwords may have changed; earlier successful checks no longer count
+            self._verified.clear()
+        return self._users
+
+    def _credential_digest(self, username, password):
+        message = username.encode() + b"\0" + password.encode()
+        return hmac.new(self._digest_key, message, hashlib.sha256).digest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash the plaintext passwords in a users file.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("users_file", nargs="?", default="users.json")
+    args = parser.parse_args()
+    count = migrate_users_file(args.users_file)
+    print(f"Migrated {count} password(s) in {args.users_file}.")
@@ -0,0 +1,94 @@
+import math
+import os
+import platform
+import sys
+import time
+
+# Helpers shared by the benchmark scripts: timing, percentiles and result files.
+# The scripts are run from the repository root, e.g. python benchmarks/microbench.py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import codec  # noqa: E402
+
+# Result files go here unless --output is given
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile (``fraction`` from 0 to 1) of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, elapsed=None):
+    """Summarize per-operation ``latencies`` (seconds) as a result entry.
+
+    ``elapsed`` is the wall-clock time the operations took; it defaults to
+    their sum, which is right for operations run one after another.
+    Latencies are reported in milliseconds.
+    """
+    values = sorted(latencies)
+    elapsed = sum(values) if elapsed is None else elapsed
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 4)
+
+    return {
+        "count": len(values),
+        "ops_per_sec": round(len(values) / elapsed, 1) if elapsed else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 0.50)),
+        "p95_ms": ms(percentile(values, 0.95)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def time_calls(function, iterations):
+    """Call ``function(i)`` for i in range(iterations); return each call's latency in seconds."""
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "codec": codec.NAME,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(path, benchmark, config, results):
+    """Write a result file: environment, configuration and one summary per benchmark; return its path."""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{benchmark}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    document = {"benchmark": benchmark, "environment": environment(), "config": config, "results": results}
+    with open(path, "wb") as file:
+        file.write(codec.dumps(document, pretty=True))
+    return path
+
+
+def print_results(results):
+    print(f"{'benchmark':<28} {'count':>8} {'ops/sec':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<28} {result['count']:>8} {format_number(result['ops_per_sec']):>11} "
+            f"{format_number(result['p50_ms']):>9} {format_number(result['p95_ms']):>9} {format_number(result['p99_ms']):>9}"
+        )
+
+
+def format_number(value):
+    if value is None:
+        return "-"
+    return f"{value:.1f}" if value >= 100 else f"{value:.3f}"
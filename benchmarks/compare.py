@@ -0,0 +1,41 @@
+import argparse
+
+import common  # first: puts the repository root on sys.path
+import codec
+
+# Compare two result files from microbench.py or loadgen.py, e.g.
+#   python benchmarks/compare.py benchmarks/results/microbench-A.json benchmarks/results/microbench-B.json
+# Prints p50/p99 latency and ops/sec for every benchmark in both, with the change from the first to the second.
+
+
+def load(path):
+    with open(path, "rb") as file:
+        return codec.loads(file.read())
+
+
+def change(before, after):
+    if not before or after is None:
+        return "-"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+    baseline, candidate = load(args.baseline)["results"], load(args.candidate)["results"]
+
+    print(f"{'benchmark':<28} {'p50 ms':>21} {'p99 ms':>21} {'ops/sec':>25}")
+    for name in baseline:
+        if name not in candidate:
+            continue
+        cells = []
+        for key in ("p50_ms", "p99_ms", "ops_per_sec"):
+            before, after = baseline[name][key], candidate[name][key]
+            cells.append(f"{common.format_number(after)} ({change(before, after)})")
+        print(f"{name:<28} {cells[0]:>21} {cells[1]:>21} {cells[2]:>25}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import random
+from datetime import date, datetime, timedelta
+
+import common  # first: puts the repository root on sys.path
+from auth import hash_password
+from storage import new_task_id, save_data
+
+# Synthetic data for the benchmarks: tasks.json and users.json in the service's
+# formats, with --users users (user00000, user00001, ...) of --tasks tasks each,
+# e.g.
+#   python benchmarks/generate_dataset.py --users 100 --tasks 1000 --out /tmp/bench
+# Every user has the same password (--password). Task contents follow --seed;
+# task ids are new each run.
+
+PRIORITIES = ("High", "Medium", "Low")
+WORDS = ("report", "review", "email", "invoice", "meeting", "draft", "backup", "deploy", "call", "plan")
+
+
+def username(index):
+    return f"user{index:05d}"
+
+
+def make_task(rng, index):
+    due = date(2024, 1, 1) + timedelta(days=rng.randrange(730))
+    created = datetime(2023, 1, 1) + timedelta(seconds=rng.randrange(365 * 86400))
+    return {
+        "name": f"{rng.choice(WORDS)} {index}",
+        "priority": rng.choice(PRIORITIES),
+        "due_date": due.isoformat(),
+        "description": " ".join(rng.choice(WORDS) for _ in range(rng.randrange(3, 15))),
+        "completed": rng.random() < 0.3,
+        "timestamp": created.strftime("%Y-%m-%d %H:%M:%S"),
+        "id": new_task_id(),
+    }
+
+
+def generate(directory, users, tasks_per_user, password="password", seed=0):
+    """Write tasks.json and users.json into ``directory``; return the usernames."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    usernames = [username(index) for index in range(users)]
+    tasks = {name: [make_task(rng, index) for index in range(tasks_per_user)] for name in usernames}
+    save_data(os.path.join(directory, "tasks.json"), tasks)
+    # One hash for everyone: scrypt is deliberately slow, and the benchmarks do not need distinct salts
+    password_hash = hash_password(password)
+    save_data(os.path.join(directory, "users.json"), {name: password_hash for name in usernames})
+    return usernames
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic tasks.json / users.json for benchmarking.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks per user")
+    parser.add_argument("--password", default="password", help="password of every user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="directory to write tasks.json and users.json to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    generate(args.out, args.users, args.tasks, args.password, args.seed)
+    print(f"Wrote {args.users} users x {args.tasks} tasks to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import http.client
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import common  # first: puts the repository root on sys.path
+import codec
+import generate_dataset
+
+# Load generator for /task: --concurrency client threads send a weighted mix
+# of requests for --duration seconds, e.g.
+#   python benchmarks/loadgen.py --concurrency 16 --duration 10
+#   python benchmarks/loadgen.py --url http://127.0.0.1:8000 --users 100 --concurrency 64
+# Without --url the app runs in-process behind Flask's test client, on a
+# generated dataset in a temporary directory; --shared runs it in the
+# shared-storage mode serve.py uses for several workers, where each thread's
+# user is written through under that user's lock. With --url the server must hold
+# users user00000... with --password (see generate_dataset.py). Each thread
+# logs in once and keeps its connection open. Reports p50/p95/p99 latency and
+# ops/sec per action and overall, and saves them as JSON.
+
+DEFAULT_MIX = "get_tasks=60,get_tasks_page=10,add_task=10,edit_task=10,remove_task=10"
+
+
+class TestClientTransport:
+    """Requests through Flask's test client, in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, body, headers):
+        response = self.client.post(path, data=codec.dumps(body), headers={**headers, "Content-Type": "application/json"})
+        return response.status_code, codec.loads(response.data) if response.data else None
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Requests over one keep-alive HTTP connection."""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+    def post(self, path, body, headers):
+        self.connection.request("POST", path, codec.dumps(body), {**headers, "Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        data = response.read()
+        return response.status, codec.loads(data) if data else None
+
+    def close(self):
+        self.connection.close()
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition("=")
+        mix[action.strip()] = float(weight or 1)
+    return mix
+
+
+def worker(index, transport, args, mix, deadline, results, errors):
+    rng = random.Random(index)
+    username = generate_dataset.username(index % args.users)
+    status, body = transport.post("/login", {"user_details": {"username": username, "password": args.password}}, {})
+    if status != 200 or body.get("status") != "success":
+        errors.append(f"login failed for {username}: {status} {body}")
+        return
+    headers = {"Authorization": f"Bearer {body['token']}"}
+    actions, weights = list(mix), list(mix.values())
+    added = []  # ids of tasks this thread added, for edit / remove
+    latencies = {action: [] for action in actions}
+    failures = 0
+
+    while time.monotonic() < deadline:
+        action = rng.choices(actions, weights)[0]
+        if action in ("edit_task", "remove_task") and not added:
+            action = "add_task"
+        if action == "add_task":
+            request = {"add_task": True, "task_details": {"name": f"load {index}", "priority": "Medium", "due_date": "2025-06-01"}}
+        elif action == "edit_task":
+            request = {"edit_task": True, "task_id": rng.choice(added), "updated_task_details": {"priority": "Low"}}
+        elif action == "remove_task":
+            request = {"remove_task": True, "task_id": added.pop(rng.randrange(len(added)))}
+        elif action == "get_tasks_page":
+            request = {"get_tasks": True, "limit": 50, "sort_by": "due_date"}
+        else:
+            request = {action: True}
+
+        start = time.perf_counter()
+        status, body = transport.post("/task", request, headers)
+        latencies.setdefault(action, []).append(time.perf_counter() - start)
+        if status != 200 or body.get("status") == "failure":
+            failures += 1
+        elif action == "add_task":
+            added.append(body["task_id"])
+
+    results.append((latencies, failures))
+
+
+def run(args, make_transport):
+    mix = parse_mix(args.mix)
+    results = []
+    errors = []
+    transports = [make_transport() for _ in range(args.concurrency)]
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(index, transports[index], args, mix, deadline, results, errors))
+        for index in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for transport in transports:
+        transport.close()
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    # Per action and overall; ops/sec over the wall-clock time of the whole run
+    by_action = {}
+    for latencies, _ in results:
+        for action, values in latencies.items():
+            by_action.setdefault(action, []).extend(values)
+    summary = {action: common.summarize(values, elapsed) for action, values in sorted(by_action.items()) if values}
+    summary["all"] = common.summarize([value for values in by_action.values() for value in values], elapsed)
+    summary["all"]["failures"] = sum(failures for _, failures in results)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive /task with concurrent clients and report latency and throughput.")
+    parser.add_argument("--url", help="server to load (default: the app in-process, via Flask's test client)")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"action=weight list (default: {DEFAULT_MIX})")
+    parser.add_argument("--users", type=int, default=50, help="users the clients log in as")
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks per user of the generated dataset (in-process only)")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--storage", default="json", help="storage backend (in-process only)")
+    parser.add_argument("--shared", action="store_true", help="write through as with several workers (in-process only)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/loadgen-<time>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.url:
+        results = run(args, lambda: HTTPTransport(args.url))
+    else:
+        workdir = tempfile.mkdtemp(prefix="task-load-")
+        cwd = os.getcwd()
+        try:
+            print(f"Generating {args.users} users x {args.tasks} tasks...", file=sys.stderr)
+            generate_dataset.generate(workdir, args.users, args.tasks, args.password)
+            # task_microservice opens its storage in the current directory when imported
+            os.chdir(workdir)
+            os.environ["TASK_STORAGE_BACKEND"] = args.storage
+            if args.shared:
+                os.environ["TASK_SHARED_STORAGE"] = "1"
+            import task_microservice
+
+            results = run(args, lambda: TestClientTransport(task_microservice.app))
+            task_microservice.store.close()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    common.print_results(results)
+    print(f"Failures: {results['all']['failures']}")
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    print(f"Saved {common.save_results(args.output, 'loadgen', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import common  # first: puts the repository root on sys.path
+import generate_dataset
+
+# Microbenchmarks of the service's building blocks, run in-process against a
+# synthetic dataset, e.g.
+#   python benchmarks/microbench.py --users 50 --tasks 1000 --storage json
+# Reports p50/p95/p99 latency and ops/sec per benchmark and saves them as JSON
+# (benchmarks/results/ unless --output is given). The dataset is generated, or
+# copied from --data, into a temporary directory, so no real data is touched.
+#
+# Action benchmarks authenticate with a session token, so they measure the
+# action itself; password checks are measured on their own.
+
+
+def run(args, workdir):
+    # task_microservice opens its storage in the current directory when imported
+    os.chdir(workdir)
+    os.environ["TASK_STORAGE_BACKEND"] = args.storage
+    import auth
+    import task_microservice as service
+    from storage import load_data, save_data
+
+    usernames = sorted(load_data("users.json"))
+    password_hash = load_data("users.json")[usernames[0]]
+    tokens = [{"token": auth.issue_token(name)} for name in usernames]
+    results = {}
+
+    def bench(name, function, iterations):
+        if args.only and name not in args.only:
+            return
+        results[name] = common.summarize(common.time_calls(function, iterations))
+        print(f"  {name}: p50 {results[name]['p50_ms']} ms", file=sys.stderr)
+
+    def user(i):
+        return tokens[i % len(tokens)]
+
+    # Storage
+    data = load_data("tasks.json")
+    bench("load_data", lambda i: load_data("tasks.json"), args.file_iterations)
+    bench("save_data", lambda i: save_data("bench-copy.json", data), args.file_iterations)
+    del data
+
+    # Authentication
+    bench("verify_password", lambda i: auth.verify_password(password_hash, args.password), args.auth_iterations)
+    credentials = [{"username": name, "password": args.password} for name in usernames]
+    for details in credentials:
+        service.authenticate(details)  # fill the login cache
+    bench("authenticate_cached", lambda i: service.authenticate(credentials[i % len(credentials)]), args.iterations)
+    bench("authenticate_token", lambda i: service.authenticate(user(i)), args.iterations)
+
+    # Actions. Tasks added by add_task are then edited and removed, so the dataset ends as it began.
+    added = [None] * args.iterations
+
+    def add(i):
+        added[i] = service.add_task({"name": f"bench {i}", "priority": "High", "due_date": "2025-01-01"}, user(i))["task_id"]
+
+    bench("add_task", add, args.iterations)
+    if all(added):
+        bench("edit_task", lambda i: service.edit_task(None, {"priority": "Low"}, user(i), added[i]), args.iterations)
+        bench("remove_task", lambda i: service.remove_task(None, user(i), added[i]), args.iterations)
+    bench("get_tasks", lambda i: service.get_tasks(user(i)), args.iterations)
+    bench("get_tasks_filtered", lambda i: service.get_tasks(user(i), {"priority": "High", "completed": False}), args.iterations)
+    bench("get_tasks_page", lambda i: service.get_tasks(user(i), limit=50, sort_by="due_date"), args.iterations)
+    etags = [service.store.version(name) for name in usernames]
+    bench("get_tasks_not_modified", lambda i: service.get_tasks(user(i), if_none_match=etags[i % len(etags)]), args.iterations)
+    bench("get_changes", lambda i: service.get_changes(user(i), etags[i % len(etags)]), args.iterations)
+    operations = [{"add_task": True, "task_details": {"name": "batch"}}] * 10
+    bench("batch_10_adds", lambda i: service.batch(operations, user(i)), args.iterations // 10 or 1)
+
+    service.store.close()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of storage, authentication and each /task action.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks per user")
+    parser.add_argument("--data", help="directory with tasks.json / users.json to use instead of generating one")
+    parser.add_argument("--password", default="password", help="password of the users (for --data)")
+    parser.add_argument("--storage", default="json", help="storage backend (see STORAGE_BACKEND in task_microservice.py)")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per action benchmark")
+    parser.add_argument("--file-iterations", type=int, default=20, help="calls of load_data / save_data")
+    parser.add_argument("--auth-iterations", type=int, default=20, help="password checks")
+    parser.add_argument("--only", type=lambda text: text.split(","), help="comma-separated benchmark names")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/microbench-<time>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="task-bench-")
+    cwd = os.getcwd()
+    try:
+        if args.data:
+            for name in ("tasks.json", "users.json"):
+                shutil.copy(os.path.join(args.data, name), workdir)
+        else:
+            print(f"Generating {args.users} users x {args.tasks} tasks...", file=sys.stderr)
+            generate_dataset.generate(workdir, args.users, args.tasks, args.password)
+        results = run(args, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    common.print_results(results)
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    print(f"Saved {common.save_results(args.output, 'microbench', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import json
+import os
+
+# JSON encoding for request bodies, responses and storage. orjson is used when
+# it is installed (several times faster than the standard library); otherwise
+# the standard json module. Both read and write the same JSON, so data written
+# with one is read back by the other.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Name of the codec in use, reported at startup
+NAME = "orjson" if orjson is not None else "json"
+
+# Files are written compactly; set TASK_JSON_PRETTY=1 for indented, human-readable files
+PRETTY = os.environ.get("TASK_JSON_PRETTY") == "1"
+
+
+def dumps(obj, pretty=False):
+    """Encode ``obj`` as UTF-8 JSON bytes (compact unless ``pretty``)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+        except TypeError:
+            # Something orjson refuses, e.g. an integer wider than 64 bits; the standard library copes
+            pass
+    if pretty:
+        return json.dumps(obj, indent=4).encode()
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def loads(data):
+    """Decode JSON from bytes or str; raises ValueError if it is not valid JSON."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # Invalid, or something only the standard library accepts (NaN, Infinity)
+            pass
+    return json.loads(data)
@@ -1,23 +1,57 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+import itertools
+import os
 from datetime import datetime
-import json
+from auth import hash_password, verify_password
+from desktop_worker import IOWorker
+from storage import FileLock, backfill_task_ids, load_data, new_task_id, open_repository, save_data
+from task_client import RemoteRepository
+from task_index import TaskIndex, matches
+
 # File paths for storage
 TASKS_FILE = "tasks.json"
 USERS_FILE = "users.json"
 
-# Load data from files
-def load_data(file_path):
-    try:
-        with open(file_path, "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
+# Task storage backend, see storage.py ("json", "journal", "sqlite" or "sharded")
+STORAGE_BACKEND = "json"
+
+# Long task lists are rendered this many rows at a time: the next rows are
+# added when the list is scrolled near its end
+TASK_LIST_PAGE_ROWS = 500
+
+# The search box searches once typing pauses for this long, in milliseconds
+SEARCH_DELAY_MS = 150
+
+# Seconds to wait for pending writes when the window is closed
+CLOSE_FLUSH_SECONDS = 10
+
+# Remote mode: with TASK_SERVER_URL set (e.g. http://127.0.0.1:5000) the app
+# works against the task service instead of local storage. Tasks are cached in
+# CACHE_DIR, and changes made while the server is unreachable are queued there
+# and sent once it is back
+SERVER_URL = os.environ.get("TASK_SERVER_URL")
+CACHE_DIR = "tasks.cache"
+
+# How often queued changes are resent while the server is unreachable, in milliseconds
+SYNC_INTERVAL_MS = 30000
+
+
+def task_row(task):
+    """The values of a task's row in the task list."""
+    return (
+        task.get("name", ""),
+        task.get("priority", ""),
+        task.get("due_date", ""),
+        task.get("timestamp", ""),
+        "✔" if task.get("completed") else "❌",
+    )
+
+
+def searchable(task):
+    """The text the search box matches: a task's name and description, lowercased."""
+    return f"{task.get('name') or ''}\n{task.get('description') or ''}".lower()
 
-# Save data to files
-def save_data(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
 
 # Main App Class
 class TaskApp:
@@ -29,7 +63,27 @@ class TaskApp:
 
         # Initialize data
         self.users = load_data(USERS_FILE)
-        self.tasks = load_data(TASKS_FILE)
+        if SERVER_URL:
+            self.repository = RemoteRepository(SERVER_URL, CACHE_DIR)
+        else:
+            self.repository = open_repository(STORAGE_BACKEND, TASKS_FILE)
+        self.remote = bool(SERVER_URL)
+        # id -> task for the logged-in user. Their order is kept by the index (the
+        # position ordering), so an edit or delete never searches or shifts a list
+        self.task_by_id = {}
+        self.renamed_ids = {}  # remote mode: local id -> the id the server gave the task
+
+        # The filter window's choice (in task_index.parse_filters form) and the search
+        # box's text, answered from indexes kept up to date on every change
+        self.filters = {}
+        self.search = ""
+        self.search_job = None  # the pending debounced search
+        self.index_tasks()
+
+        # Writes run on a background thread so the window never waits for the disk
+        self.writer = IOWorker(root, self.repository.persist)
+        self.save_failing = False  # an error about failed saves is showing
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Styling
         self.bg_color = "#f5f5f5"
@@ -77,12 +131,28 @@ class TaskApp:
 
     def login(self, username, password):
         """Authenticate user."""
-        if username in self.users and self.users[username] == password:
-            self.user = username
-            self.show_task_list_screen()
+        if self.remote:
+            # Against the server, on the background worker; it also sends queued changes and refreshes the cache
+            self.writer.run(
+                lambda: self.repository.login(username, password),
+                on_done=lambda offline: self.logged_in(username, offline),
+                on_error=lambda error: messagebox.showerror("Error", str(error)),
+            )
+        elif verify_password(self.users.get(username), password):
+            self.logged_in(username)
         else:
             messagebox.showerror("Error", "Invalid username or password.")
 
+    def logged_in(self, username, offline=False):
+        self.user = username
+        self.load_tasks(username)
+        self.renamed_ids = {}
+        self.show_task_list_screen()
+        if self.remote:
+            if offline:
+                messagebox.showinfo("Offline", "The server cannot be reached. Showing saved tasks; changes will be sent when it is back.")
+            self.root.after(SYNC_INTERVAL_MS, self.sync)
+
     def show_registration_screen(self):
         """Display registration screen."""
         for widget in self.root.winfo_children():
@@ -106,15 +176,37 @@ class TaskApp:
 
     def register(self, username, password):
         """Register a new user."""
-        if username in self.users:
-            messagebox.showerror("Error", "Username already exists.")
-            return
         if not username or not password:
             messagebox.showerror("Error", "Both fields are required.")
             return
+        if self.remote:
+            messagebox.showerror("Error", "Accounts are managed on the server; ask its administrator for one.")
+            return
+
+        # Hashing the password and writing users.json happen on the background worker
+        self.writer.run(
+            lambda: self.add_user(username, password),
+            on_done=self.registered,
+            on_error=lambda error: messagebox.showerror("Error", f"Registration failed: {error}"),
+        )
 
-        self.users[username] = password
-        save_data(USERS_FILE, self.users)
+    def add_user(self, username, password):
+        """Add a user to users.json; return False if the name is taken. Runs on the background worker."""
+        # Re-read users.json under its lock so a user registered elsewhere meanwhile is not lost
+        with FileLock(USERS_FILE):
+            users = load_data(USERS_FILE)
+            if username in users:
+                self.users = users
+                return False
+            users[username] = hash_password(password)
+            save_data(USERS_FILE, users)
+        self.users = users
+        return True
+
+    def registered(self, added):
+        if not added:
+            messagebox.showerror("Error", "Username already exists.")
+            return
         messagebox.showinfo("Success", "Registration successful! You can now log in.")
         self.show_login_screen()
 
@@ -135,15 +227,38 @@ class TaskApp:
             self.root, text="Filter Tasks", bg=self.button_color, fg=self.text_color, command=self.filter_tasks
         ).pack(pady=10)
 
+        # Live search of names and descriptions
+        search_frame = tk.Frame(self.root, bg=self.bg_color)
+        search_frame.pack(pady=5)
+        tk.Label(search_frame, text="Search:", bg=self.bg_color).pack(side="left")
+        self.search_var = tk.StringVar(value=self.search)
+        tk.Entry(search_frame, textvariable=self.search_var, width=40).pack(side="left")
+        self.search_var.trace_add("write", self.on_search_typed)
+
+        tree_frame = tk.Frame(self.root)
+        tree_frame.pack(fill="both", expand=True)
         self.task_tree = ttk.Treeview(
-            self.root, columns=("Name", "Priority", "Due Date", "Timestamp", "Completed"), show="headings"
+            tree_frame, columns=("Name", "Priority", "Due Date", "Timestamp", "Completed"), show="headings"
         )
         self.task_tree.heading("Name", text="Name")
         self.task_tree.heading("Priority", text="Priority")
         self.task_tree.heading("Due Date", text="Due Date")
         self.task_tree.heading("Timestamp", text="Timestamp")
         self.task_tree.heading("Completed", text="Completed")
-        self.task_tree.pack(fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.task_tree.yview)
+        scrollbar.pack(side="right", fill="y")
+        self.task_tree.configure(yscrollcommand=lambda first, last: self.on_task_list_scroll(scrollbar, first, last))
+        self.task_tree.pack(side="left", fill="both", expand=True)
+
+        self.count_label = tk.Label(self.root, text="", bg=self.bg_color)
+        self.count_label.pack()
+
+        # What the task list shows: rows by task id, the ids of the current filter's
+        # result (None for all tasks) and how many rows may be rendered
+        self.rows = {}
+        self.shown_ids = None
+        self.row_limit = TASK_LIST_PAGE_ROWS
+        self.shown_count = 0
 
         self.task_tree.bind("<Double-1>", self.edit_task)  # Double-click to edit
         tk.Button(
@@ -219,14 +334,15 @@ class TaskApp:
             messagebox.showerror("Error", "Invalid date format.")
             return
 
-        if self.user not in self.tasks:
-            self.tasks[self.user] = []
-
         if task:
-            self.tasks[self.user].remove(task)
-
-        self.tasks[self.user].append(
-            {
+            # Editing keeps the task's id and place in the list
+            task = self.get_task_by_id(task["id"]) or task
+            changes = {"name": name, "priority": priority, "due_date": due_date, "description": description}
+            self.replace_task({**task, **changes})
+            self.persist([{"op": "edit", "user": self.user, "id": task["id"], "changes": changes}])
+        else:
+            new_task = {
+                "id": new_task_id(),
                 "name": name,
                 "priority": priority,
                 "due_date": due_date,
@@ -234,22 +350,101 @@ class TaskApp:
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "completed": False,  # New task is not completed by default
             }
-        )
+            self.task_by_id[new_task["id"]] = new_task
+            self.index_task(new_task)
+            self.persist([{"op": "add", "user": self.user, "task": new_task}])
 
-        save_data(TASKS_FILE, self.tasks)
         self.refresh_task_list()
         window.destroy()
 
-    def refresh_task_list(self):
-        """Refresh the task list display."""
-        for item in self.task_tree.get_children():
-            self.task_tree.delete(item)
-
-        if self.user in self.tasks:
-            for task in self.tasks[self.user]:
-                self.task_tree.insert(
-                    "", "end", values=(task["name"], task["priority"], task["due_date"], task["timestamp"], "✔" if task["completed"] else "❌")
-                )
+    def replace_task(self, task):
+        """Swap in a new version of one of the logged-in user's tasks (matched by id)."""
+        old_task = self.task_by_id[task["id"]]
+        self.task_by_id[task["id"]] = task
+        self.index_task(task, self.unindex_task(old_task))
+
+    def index_tasks(self):
+        """Build the filter and search indexes over the logged-in user's tasks."""
+        self.index = TaskIndex()
+        self.next_position = itertools.count()
+        entries = [(task_id, task, next(self.next_position)) for task_id, task in self.task_by_id.items()]
+        self.index.add_many(entries)
+        self.positions = {task_id: position for task_id, _, position in entries}  # id -> list order key
+        self.search_text = {task_id: searchable(task) for task_id, task, _ in entries}
+        self.last_search = None  # (filters, text, ids found) of the previous search
+
+    def index_task(self, task, position=None):
+        """Add a task to the indexes; a new one sorts after every other task."""
+        if position is None:
+            position = next(self.next_position)
+        self.index.add(task["id"], task, position)
+        self.positions[task["id"]] = position
+        self.search_text[task["id"]] = searchable(task)
+        self.last_search = None
+
+    def unindex_task(self, task):
+        """Remove a task from the indexes; return its position."""
+        position = self.positions.pop(task["id"])
+        self.index.remove(task["id"], task, position)
+        del self.search_text[task["id"]]
+        self.last_search = None
+        return position
+
+    def load_tasks(self, username):
+        """Load one user's tasks from storage; other users' data is left alone."""
+        with self.repository.lock(username):
+            tasks = {username: self.repository.load_user(username)}
+            # Give tasks saved before ids existed an id, and save them back once
+            if backfill_task_ids(tasks):
+                self.repository.persist([{"op": "replace_user", "user": username, "tasks": tasks[username]}])
+        self.task_by_id = {task["id"]: task for task in tasks[username]}
+        self.index_tasks()
+
+    def persist(self, ops):
+        """Queue mutation records for the logged-in user's tasks to be written to storage.
+
+        The background worker applies them to what storage currently holds,
+        so changes the service made in the meantime are kept.
+        """
+        self.writer.persist(ops, on_done=self.saved, on_error=self.save_failed)
+
+    def saved(self, result):
+        self.save_failing = False
+        if result:
+            self.remap_ids(result)
+
+    def sync(self):
+        """Remote mode: resend queued changes every SYNC_INTERVAL_MS."""
+        self.writer.run(self.repository.sync, on_done=self.saved)
+        self.root.after(SYNC_INTERVAL_MS, self.sync)
+
+    def remap_ids(self, new_ids):
+        """Remote mode: switch tasks added here to the ids the server gave them."""
+        self.renamed_ids.update(new_ids)
+        for old_id, new_id in new_ids.items():
+            task = self.task_by_id.pop(old_id, None)
+            if task is not None:
+                position = self.unindex_task(task)
+                task = self.task_by_id[new_id] = {**task, "id": new_id}
+                self.index_task(task, position)
+        selection = [new_ids.get(task_id, task_id) for task_id in self.task_tree.selection()]
+        self.refresh_task_list()
+        self.task_tree.selection_set(selection)
+
+    def save_failed(self, error):
+        # Failed writes are retried in the background; say so once, not on every attempt
+        if not self.save_failing:
+            self.save_failing = True
+            messagebox.showerror("Error", f"Could not save changes ({error}). Retrying in the background.")
+
+    def on_close(self):
+        """Write pending changes, then close the window."""
+        if not self.writer.flush(timeout=CLOSE_FLUSH_SECONDS):
+            if not messagebox.askyesno("Unsaved Changes", "Some changes could not be saved yet. Quit anyway?"):
+                return
+        self.writer.close()
+        self.repository.close()
+        self.root.destroy()
 
     def delete_task(self):
         """Delete the selected task."""
@@ -258,33 +453,20 @@ class TaskApp:
             messagebox.showerror("Error", "No task selected.")
             return
 
-        task_values = self.task_tree.item(selected_item)["values"]
-        
-        task_found = False
-        # Loop through tasks to find the matching task
-        for task in self.tasks[self.user]:
-            
-            # Create a task tuple excluding the 'completed' field for comparison
-            task_tuple = (task["name"], task["priority"], task["due_date"], task["timestamp"])
-            
-            # Compare the task tuple from list with the task values from the tree (ignoring 'completed')
-            if task_tuple == tuple(task_values[:4]):  # Compare without 'completed' field
-                self.tasks[self.user].remove(task)  # Remove the task
-                task_found = True
-                break
-        
-        if task_found:
-            save_data(TASKS_FILE, self.tasks)
+        # Treeview rows are keyed by task id
+        task = self.task_by_id.pop(selected_item[0], None)
+
+        if task is not None:
+            self.unindex_task(task)
+            self.persist([{"op": "remove", "user": self.user, "id": task["id"]}])
             self.refresh_task_list()
         else:
             messagebox.showerror("Error", "Task not found.")
 
 
-    def get_task_index_by_id(self, selected_item):
-        for idx, task in enumerate(self.tasks[self.user]):
-            if task["timestamp"] == selected_item:  # or any unique identifier
-                return idx
-        return None
+    def get_task_by_id(self, task_id):
+        # An edit window opened before a task got its server id still uses the old one
+        return self.task_by_id.get(self.renamed_ids.get(task_id, task_id))
 
 
     def edit_task(self, event=None):
@@ -353,30 +535,21 @@ class TaskApp:
             if not task_name or not due_date:
                 messagebox.showerror("Error", "Task Name and Due Date are required.")
                 return
-            
-            current_timestamp = self.task_tree.item(selected_item)["values"][3]
-            # Update the task data
-            updated_data = (
-                task_name,
-                priority,
-                due_date,
-                current_timestamp,  # You can keep the timestamp as is or update it
-                "✔" if completion_status == "Completed" else "❌",
-            )
 
-            # Update the task in the tree view
-            self.task_tree.item(selected_item, values=updated_data)
-
-            # Optionally update the tasks list if you store tasks outside of the tree view
-            task_index = self.get_task_index_by_id(selected_item)  # Modify if necessary to match your data structure
-            if task_index is not None:
-                self.tasks[self.user][task_index] = {
+            # Update the stored task (rows are keyed by task id) and save it
+            task = self.get_task_by_id(selected_item[0])
+            if task is not None:
+                changes = {
                     "name": task_name,
                     "priority": priority,
                     "due_date": due_date,
-                    "timestamp": current_timestamp,  # Update with the actual timestamp if needed
                     "completed": completion_status == "Completed",
                 }
+                self.replace_task({**task, **changes})
+                self.persist([{"op": "edit", "user": self.user, "id": task["id"], "changes": changes}])
+
+            # Redraws just this row (or drops it, if it no longer passes the filter)
+            self.refresh_task_list()
 
             # Close the edit window
             edit_window.destroy()
@@ -384,18 +557,6 @@ class TaskApp:
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred while saving changes: {e}")
 
-
-        """Edit the selected task."""
-        selected_item = self.task_tree.selection()
-        if not selected_item:
-            return
-
-        task_values = self.task_tree.item(selected_item)["values"]
-        for task in self.tasks[self.user]:
-            if (task["name"], task["priority"], task["due_date"], task["timestamp"]) == tuple(task_values):
-                self.show_add_task_screen(task)
-                break
-
     def filter_tasks(self):
         """Filter tasks based on priority or completion status."""
         filter_window = tk.Toplevel(self.root)
@@ -410,7 +571,7 @@ class TaskApp:
         priority_label.pack(pady=5)
 
         priority_combo = ttk.Combobox(filter_window, values=["All", "High", "Medium", "Low"], state="readonly")
-        priority_combo.set("All")
+        priority_combo.set(next(iter(self.filters.get("priority", ["All"]))))
         priority_combo.pack(pady=5)
 
         # Option to filter by completion status
@@ -418,7 +579,7 @@ class TaskApp:
         completed_label.pack(pady=5)
 
         completed_combo = ttk.Combobox(filter_window, values=["All", "Completed", "Pending"], state="readonly")
-        completed_combo.set("All")
+        completed_combo.set({True: "Completed", False: "Pending"}.get(self.filters.get("completed"), "All"))
         completed_combo.pack(pady=5)
 
         # Apply filter button
@@ -434,46 +595,121 @@ class TaskApp:
 
     def apply_filter(self, priority, completed, window):
         """Apply the selected filter to the task list."""
-        filtered_tasks = []
-
-        # Get all tasks for the logged-in user
-        tasks_to_filter = self.tasks.get(self.user, [])
-
-        # Filter by priority
+        self.filters = {}
         if priority != "All":
-            tasks_to_filter = [task for task in tasks_to_filter if task["priority"] == priority]
+            self.filters["priority"] = {priority}
+        if completed != "All":
+            self.filters["completed"] = completed == "Completed"
 
-        # Filter by completion status
-        if completed == "Completed":
-            tasks_to_filter = [task for task in tasks_to_filter if task["completed"]]
-        elif completed == "Pending":
-            tasks_to_filter = [task for task in tasks_to_filter if not task["completed"]]
-
-        # Refresh the task list with the filtered tasks
-        self.refresh_task_list(filtered_tasks=tasks_to_filter)
+        # Refresh the task list with the filtered tasks, from the top
+        self.row_limit = TASK_LIST_PAGE_ROWS
+        self.refresh_task_list()
+        self.task_tree.yview_moveto(0)
 
         window.destroy()
 
-    def refresh_task_list(self, filtered_tasks=None):
-        """Refresh the task list display based on filtered tasks."""
-        for item in self.task_tree.get_children():
-            self.task_tree.delete(item)
-
-        # Use filtered tasks or show all tasks if no filter is applied
-        tasks_to_display = filtered_tasks if filtered_tasks else self.tasks.get(self.user, [])
-
-        for task in tasks_to_display:
-            self.task_tree.insert(
-                "",
-                "end",
-                values=(
-                    task["name"],
-                    task["priority"],
-                    task["due_date"],
-                    task["timestamp"],
-                    "✔" if task["completed"] else "❌",
-                ),
-            )
+    def on_search_typed(self, *args):
+        """Search once typing pauses for SEARCH_DELAY_MS, not on every key."""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.apply_search)
+
+    def apply_search(self):
+        self.search_job = None
+        self.search = self.search_var.get().strip()
+        self.row_limit = TASK_LIST_PAGE_ROWS
+        self.refresh_task_list()
+        self.task_tree.yview_moveto(0)
+
+    def refresh_task_list(self):
+        """Refresh the task list display: all tasks, or those passing the filter and the search."""
+        self.shown_ids = self.matching_ids()
+        self.render_rows()
+
+    def matching_ids(self):
+        """Ids of the tasks passing the filter and the search, in list order; None if neither is set.
+
+        The filter is answered from the index: only the tasks of its most
+        selective bucket are checked, not the whole list.
+        """
+        if not self.filters and not self.search:
+            return None
+        candidates = self.index.candidates(self.filters, len(self.positions)) if self.filters else None
+        if candidates is None:
+            ids = [task_id for _, task_id in self.index.orderings[None]]
+        else:
+            ids = sorted(candidates, key=self.positions.__getitem__)
+        if self.filters:
+            ids = [task_id for task_id in ids if matches(self.task_by_id[task_id], self.filters)]
+        return self.search_ids(ids) if self.search else ids
+
+    def search_ids(self, ids):
+        """The ids among ``ids`` whose task's name or description contains the search text, in any case.
+
+        Typing on only narrows the previous search, so while the filter and the
+        tasks are unchanged its result is searched instead of ``ids``.
+        """
+        text = self.search.lower()
+        if self.last_search is not None and self.last_search[0] == self.filters and self.last_search[1] in text:
+            ids = self.last_search[2]
+        found = [task_id for task_id in ids if text in self.search_text[task_id]]
+        self.last_search = (dict(self.filters), text, found)
+        return found
+
+    def shown_tasks(self):
+        """The first ``row_limit`` tasks the list shows, in order, and how many it shows in all.
+
+        That is all of the user's tasks or the filter's result.  For all tasks
+        only the first ``row_limit`` entries of the position ordering are read.
+        """
+        if self.shown_ids is None:
+            entries = self.index.orderings[None][:self.row_limit]
+            return [self.task_by_id[task_id] for _, task_id in entries], len(self.task_by_id)
+        tasks = [self.task_by_id[task_id] for task_id in self.shown_ids if task_id in self.task_by_id]
+        return tasks[:self.row_limit], len(tasks)
+
+    def render_rows(self):
+        """Bring the task list in line with shown_tasks(), touching only the rows that differ.
+
+        Rows are matched to tasks by id: rows of tasks no longer shown are
+        deleted, new tasks are inserted in place and edited tasks get their
+        values updated, so one save or delete costs one row, not the whole
+        list.  At most ``row_limit`` rows are rendered.
+        """
+        tasks, total = self.shown_tasks()
+        wanted = {task["id"]: task_row(task) for task in tasks}
+
+        stale = [task_id for task_id in self.rows if task_id not in wanted]
+        if stale:
+            self.task_tree.delete(*stale)
+            for task_id in stale:
+                del self.rows[task_id]
+
+        # Rows are only moved if the remaining ones are out of order (filters keep the list order)
+        in_order = [task_id for task_id in wanted if task_id in self.rows] == list(self.task_tree.get_children())
+        for index, (task_id, values) in enumerate(wanted.items()):
+            if task_id not in self.rows:
+                self.task_tree.insert("", index, iid=task_id, values=values)
+            else:
+                if not in_order:
+                    self.task_tree.move(task_id, "", index)
+                if self.rows[task_id] != values:
+                    self.task_tree.item(task_id, values=values)
+            self.rows[task_id] = values
+
+        if total > len(self.rows):
+            self.count_label.config(text=f"Showing {len(self.rows)} of {total} tasks; scroll down for more")
+        else:
+            self.count_label.config(text=f"{total} tasks")
+        self.shown_count = total
+
+    def on_task_list_scroll(self, scrollbar, first, last):
+        """Track the task list's scroll position; render the next rows near the end."""
+        scrollbar.set(first, last)
+        # Only once the rows asked for last time are all there
+        if float(last) >= 0.9 and len(self.rows) >= self.row_limit and self.shown_count > self.row_limit:
+            self.row_limit += TASK_LIST_PAGE_ROWS
+            self.root.after_idle(self.render_rows)
 
 
 # Main Function
@@ -0,0 +1,118 @@
+import collections
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How often the Tk side collects finished jobs, in milliseconds
+POLL_MS = 50
+
+# Seconds between attempts to write changes that failed to save
+RETRY_SECONDS = 5
+
+
+class IOWorker:
+    """Runs the desktop app's storage I/O on a background thread, in order.
+
+    ``persist(ops)`` queues mutation records for ``persist_ops`` (e.g. a
+    repository's ``persist``).  Records queued while an earlier write is in
+    progress are coalesced into a single call.  A write that fails is retried
+    every RETRY_SECONDS, ahead of anything queued after it, so no change is
+    lost or reordered.  ``run(job)`` queues any other callable.
+
+    Callbacks (``on_done(result)``, ``on_error(exception)``) are called on the
+    Tk thread: the worker hands results over through a queue that the Tk side
+    collects with ``root.after``.  Tk is never touched from the worker thread.
+    Call ``flush()`` before the window closes, then ``close()``.
+    """
+
+    def __init__(self, root, persist_ops):
+        self.root = root
+        self.persist_ops = persist_ops
+        self._jobs = collections.deque()  # (kind, payload, on_done, on_error)
+        self._condition = threading.Condition()
+        self._busy = False
+        self._closed = False
+        self._results = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="desktop-io", daemon=True)
+        self._thread.start()
+        self.root.after(POLL_MS, self._deliver)
+
+    def persist(self, ops, on_done=None, on_error=None):
+        """Queue mutation records to be written."""
+        self._submit(("persist", list(ops), on_done, on_error))
+
+    def run(self, job, on_done=None, on_error=None):
+        """Queue ``job()``; ``on_done`` gets its return value."""
+        self._submit(("run", job, on_done, on_error))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; return False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._jobs and not self._busy, timeout)
+
+    def close(self, timeout=1.0):
+        """Stop the worker; anything still queued (failed writes) is dropped."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _submit(self, job):
+        with self._condition:
+            self._jobs.append(job)
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or self._closed)
+                if self._closed:
+                    return
+                batch = [self._jobs.popleft()]
+                if batch[0][0] == "persist":
+                    # Coalesce the writes queued behind this one
+                    while self._jobs and self._jobs[0][0] == "persist":
+                        batch.append(self._jobs.popleft())
+                self._busy = True
+
+            try:
+                if batch[0][0] == "persist":
+                    result = self.persist_ops([op for _, ops, _, _ in batch for op in ops])
+                else:
+                    result = batch[0][1]()
+            except Exception as error:
+                logger.exception("Background %s failed", batch[0][0])
+                for _, _, _, on_error in batch:
+                    self._results.put((on_error, error))
+                with self._condition:
+                    if batch[0][0] == "persist":
+                        # Retry before anything queued later
+                        self._jobs.extendleft(reversed(batch))
+                        self._condition.wait_for(lambda: self._closed, RETRY_SECONDS)
+                    self._busy = False
+                    self._condition.notify_all()
+                continue
+
+            for _, _, on_done, _ in batch:
+                self._results.put((on_done, result))
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _deliver(self):
+        # On the Tk thread
+        while True:
+            try:
+                callback, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if callback is None:
+                continue
+            try:
+                callback(value)
+            except Exception:
+                logger.exception("Callback %r failed", callback)
+        if not self._closed:
+            self.root.after(POLL_MS, self._deliver)
@@ -0,0 +1,128 @@
+import collections
+import threading
+
+
+class ChangeBroker:
+    """In-process publish/subscribe of task change events, per user.
+
+    ``publish(username, event)`` hands an event to every current subscriber
+    of that user.  Each subscriber has a queue of at most ``queue_size``
+    events; one that falls that far behind is dropped instead of letting its
+    queue grow or making the publisher wait.  A dropped subscription has
+    ``dropped`` set and receives nothing more; its client should catch up
+    with get_changes or get_tasks and subscribe again.
+
+    At most ``max_subscribers`` subscriptions may be open at once;
+    ``subscribe()`` returns None beyond that, and once the broker is closed.
+    """
+
+    def __init__(self, queue_size=100, max_subscribers=10000):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = {}  # username -> set of Subscription
+        self._count = 0
+        self.closed = False
+
+    def subscribe(self, username):
+        """Return a new ``Subscription`` to ``username``'s events, or None if there are too many."""
+        subscription = Subscription(self, username, self.queue_size)
+        with self._lock:
+            if self.closed or self._count >= self.max_subscribers:
+                return None
+            self._subscribers.setdefault(username, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def publish(self, username, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(username, ()))
+        for subscription in subscriptions:
+            if not subscription._put(event):
+                self._remove(subscription)
+
+    def close(self):
+        """Close every subscription, waking their waiters, and refuse new ones (server shutdown)."""
+        with self._lock:
+            self.closed = True
+            subscriptions = [subscription for group in self._subscribers.values() for subscription in group]
+        for subscription in subscriptions:
+            subscription.close()
+            if subscription.on_ready is not None:
+                subscription.on_ready()
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count
+
+    def _remove(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.username)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.username]
+            self._count -= 1
+
+
+class Subscription:
+    """One subscriber's queue of events.  Use as a context manager, or call ``close()``.
+
+    Threads block in ``wait()``.  Event loops set ``on_ready`` to a callable
+    (it is called from the publishing thread whenever there is something new)
+    and collect the events with ``poll()``.
+    """
+
+    def __init__(self, broker, username, queue_size):
+        self.username = username
+        self.dropped = False
+        self.closed = False
+        self.on_ready = None
+        self._broker = broker
+        self._queue_size = queue_size
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+
+    def poll(self):
+        """Return the events received so far (possibly none) without waiting."""
+        with self._condition:
+            return self._take()
+
+    def wait(self, timeout=None):
+        """Wait up to ``timeout`` seconds for events; return them (empty on timeout or once dropped or closed)."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self.dropped or self.closed, timeout)
+            return self._take()
+
+    def close(self):
+        self._broker._remove(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _put(self, event):
+        # Returns False once the subscriber has been dropped
+        with self._condition:
+            if self.dropped or self.closed:
+                return False
+            if len(self._events) >= self._queue_size:
+                self.dropped = True
+                self._events.clear()
+            else:
+                self._events.append(event)
+            self._condition.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+        return not self.dropped
+
+    def _take(self):
+        events = list(self._events)
+        self._events.clear()
+        return events
@@ -0,0 +1,189 @@
+import bisect
+import os
+import threading
+import time
+
+# Request metrics for the task service, served in the Prometheus text format on
+# /metrics. Off unless TASK_METRICS=1 is set when the service starts; while off,
+# request() and phase() hand back a shared no-op and the repository is not
+# wrapped, so the cost is one flag check per call.
+ENABLED = os.environ.get("TASK_METRICS") == "1"
+
+# Histogram bucket upper bounds in seconds: from in-memory operations (tens of
+# microseconds) to password checks and full file rewrites (tens of ms and up)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase timings recorded outside any request (e.g. the background flusher's writes)
+BACKGROUND = "background"
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their sum and count."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Request counters and latency histograms, by action and by phase."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}   # (action, status) -> count
+        self._durations = {}  # action -> Histogram
+        self._phases = {}     # (action, phase) -> Histogram
+
+    def observe_request(self, action, status, seconds):
+        with self._lock:
+            key = (action, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._durations.get(action)
+            if histogram is None:
+                histogram = self._durations[action] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_phase(self, action, phase, seconds):
+        with self._lock:
+            histogram = self._phases.get((action, phase))
+            if histogram is None:
+                histogram = self._phases[(action, phase)] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = [
+            "# HELP task_requests_total Requests to /task by action and response status.",
+            "# TYPE task_requests_total counter",
+        ]
+        with self._lock:
+            for (action, status), count in sorted(self._requests.items()):
+                lines.append(f'task_requests_total{{action="{action}",status="{status}"}} {count}')
+            _render_histogram(
+                lines,
+                "task_request_duration_seconds",
+                "Time to handle a /task request, including encoding the response.",
+                {(("action", action),): histogram for action, histogram in self._durations.items()},
+            )
+            _render_histogram(
+                lines,
+                "task_phase_duration_seconds",
+                "Time spent in each phase of a /task request: authenticate, load, save, serialize.",
+                {
+                    (("action", action), ("phase", phase)): histogram
+                    for (action, phase), histogram in self._phases.items()
+                },
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(lines, name, help_text, histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(histograms.items()):
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+        cumulative = 0
+        for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+
+
+registry = Registry()
+_local = threading.local()
+
+
+class _RequestTimer:
+    # Times one request; phases timed on this thread meanwhile are attributed to its action
+    def __init__(self, action):
+        self.action = action
+        self.status = None
+
+    def __enter__(self):
+        self._outer = getattr(_local, "action", None)
+        _local.action = self.action
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self._start
+        _local.action = self._outer
+        registry.observe_request(self.action, "error" if exc_type else self.status or "unknown", elapsed)
+
+
+class _PhaseTimer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start
+        registry.observe_phase(getattr(_local, "action", None) or BACKGROUND, self.name, elapsed)
+
+
+class _NoOp:
+    status = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_OP = _NoOp()
+
+
+def request(action):
+    """Time a request for ``action``; set ``status`` on the returned timer before it ends."""
+    return _RequestTimer(action) if ENABLED else _NO_OP
+
+
+def phase(name):
+    """Time one phase of the current request (or of background work)."""
+    return _PhaseTimer(name) if ENABLED else _NO_OP
+
+
+def observe_request(action, status, seconds):
+    """Record a request timed by the caller, for requests that do not run on one thread."""
+    if ENABLED:
+        registry.observe_request(action, status, seconds)
+
+
+class TimedRepository:
+    """A storage repository (see storage.py) whose reads are timed as the "load"
+    phase and whose writes as "save"."""
+
+    def __init__(self, repository):
+        self._repository = repository
+
+    def __getattr__(self, name):
+        return getattr(self._repository, name)
+
+    def load(self):
+        with phase("load"):
+            return self._repository.load()
+
+    def load_user(self, username):
+        with phase("load"):
+            return self._repository.load_user(username)
+
+    def persist(self, ops):
+        with phase("save"):
+            return self._repository.persist(ops)
+
+
+def timed_repository(repository):
+    """Return ``repository`` wrapped in a ``TimedRepository`` when metrics are enabled."""
+    return TimedRepository(repository) if ENABLED else repository
@@ -0,0 +1,253 @@
+import argparse
+import logging
+import os
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import codec
+
+# Production entry point for the task service, e.g.
+#   python serve.py --workers 4 --threads 8 --keepalive 5 --port 8000
+#
+# The master process binds the port and forks the workers (pre-fork). Each
+# worker imports the app after the fork, so it has its own task store, and
+# serves connections from the shared listening socket on a fixed pool of
+# threads. Workers that die are replaced; SIGTERM or Ctrl+C stops them all
+# after in-flight requests finish. With gunicorn installed it is used instead
+# (gthread workers), unless --server builtin is given.
+
+logger = logging.getLogger("serve")
+
+# A worker that dies sooner than this after starting is restarted only after
+# the same delay, so a crashing app does not turn into a fork loop
+RESTART_DELAY = 1.0
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles each connection on a fixed pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, handler, fd=None):
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="task-http")
+        super().__init__(host, port, app, handler=handler, fd=fd)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            # Let the requests already accepted finish
+            self._pool.shutdown(wait=True)
+
+
+def make_request_handler(keepalive, access_log):
+    """Return a request handler class keeping idle connections open for ``keepalive`` seconds."""
+
+    class RequestHandler(WSGIRequestHandler):
+        # HTTP/1.1 keeps connections open between requests; 0 closes them after each response
+        protocol_version = "HTTP/1.1" if keepalive > 0 else "HTTP/1.0"
+        timeout = keepalive if keepalive > 0 else None
+
+        def log_request(self, *args, **kwargs):
+            if access_log:
+                super().log_request(*args, **kwargs)
+
+    return RequestHandler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the task service with several worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per CPU)")
+    parser.add_argument("--threads", type=int, default=8, help="request threads per worker")
+    parser.add_argument("--keepalive", type=int, default=5, help="seconds an idle connection is kept open (0 disables keep-alive)")
+    parser.add_argument("--backlog", type=int, default=1024, help="listen queue length")
+    parser.add_argument("--storage", help="task storage backend (see STORAGE_BACKEND in task_microservice.py)")
+    parser.add_argument("--server", choices=["auto", "builtin", "gunicorn"], default="auto")
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    # Read by task_microservice / auth when a worker imports them
+    if args.storage:
+        os.environ["TASK_STORAGE_BACKEND"] = args.storage
+    if args.workers > 1:
+        # Several processes write the same storage: write through under the file
+        # lock and reload whatever another worker changed
+        os.environ["TASK_SHARED_STORAGE"] = "1"
+    # Tokens issued by one worker must be accepted by every other
+    if not os.environ.get("TASK_TOKEN_SECRET"):
+        os.environ["TASK_TOKEN_SECRET"] = secrets.token_hex(32)
+
+
+def run_worker(listener, args):
+    """Serve requests from ``listener`` until SIGTERM; returns the exit status."""
+    import task_microservice  # after the fork: every worker opens its own store
+
+    server = PooledWSGIServer(
+        args.host,
+        args.port,
+        task_microservice.app,
+        args.threads,
+        make_request_handler(args.keepalive, args.access_log),
+        fd=listener.fileno(),
+    )
+    # All workers wait on the same socket; the ones that lose the race for a connection must not block
+    server.socket.setblocking(False)
+    def stop():
+        server.shutdown()
+        # Open /events streams and long polls would hold their threads, and so the exit, indefinitely
+        task_microservice.broker.close()
+
+    # shutdown() waits for serve_forever() to return, so it cannot run in the signal handler's thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=stop).start())
+    try:
+        server.serve_forever()
+    finally:
+        task_microservice.store.close()
+    return 0
+
+
+def run_master(listener, args):
+    workers = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Ctrl+C reaches the whole process group; the master turns it into SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            status = 1
+            try:
+                status = run_worker(listener, args)
+            except Exception:
+                logger.exception("Worker %d failed", os.getpid())
+            finally:
+                os._exit(status)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    logger.info("Serving on http://%s:%d with %d workers x %d threads", args.host, args.port, args.workers, args.threads)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning("Worker %d exited with status %d; starting a new one", pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        if not stopping:
+            spawn()
+    listener.close()
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class TaskApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("keepalive", args.keepalive)
+            self.cfg.set("backlog", args.backlog)
+            if args.access_log:
+                self.cfg.set("accesslog", "-")
+            self.cfg.set("post_worker_init", close_broker_on_exit)
+            self.cfg.set("worker_int", lambda worker: threading.Thread(target=close_broker).start())
+
+        def load(self):
+            # Loaded in each worker after the fork (gunicorn does not preload by default)
+            from task_microservice import app
+            return app
+
+    TaskApplication().run()
+
+
+# gunicorn's SIGTERM handler only stops the worker accepting connections. Open /events
+# streams and long polls would hold their threads until the graceful timeout, when the
+# worker is killed without flushing, so SIGTERM also ends them.
+def close_broker_on_exit(worker):
+    handle_exit = worker.handle_exit
+
+    def exit_and_close(signum, frame):
+        handle_exit(signum, frame)
+        # On a thread: the signal may have interrupted code holding the broker's lock
+        threading.Thread(target=close_broker).start()
+
+    signal.signal(signal.SIGTERM, exit_and_close)
+
+def close_broker():
+    from task_microservice import broker
+    broker.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    configure_environment(args)
+    logger.info("JSON codec: %s", codec.NAME)
+
+    if args.server == "gunicorn" or args.server == "auto" and _have_gunicorn():
+        return run_gunicorn(args)
+
+    listener = socket.create_server((args.host, args.port), backlog=args.backlog)
+    if args.workers > 1 and hasattr(os, "fork"):
+        return run_master(listener, args)
+
+    # One worker, or no fork() (Windows): serve from this process
+    if args.workers > 1:
+        logger.warning("This platform cannot fork; serving from a single process")
+    logger.info("Serving on http://%s:%d with %d threads", args.host, args.port, args.threads)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    return run_worker(listener, args)
+
+
+def _have_gunicorn():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(main())
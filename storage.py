@@ -0,0 +1,666 @@
+import contextlib
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+
+import codec
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Load data from files
+def load_data(file_path):
+    try:
+        with open(file_path, "rb") as file:
+            return codec.loads(file.read())
+    except FileNotFoundError:
+        return {}
+
+# Save data to files.  The data is written to a temporary file that is then
+# renamed over the original, so readers see the old or the new contents but
+# never a half-written file.  Files are compact unless codec.PRETTY is set.
+def save_data(file_path, data, pretty=None):
+    pretty = codec.PRETTY if pretty is None else pretty
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(codec.dumps(data, pretty))
+            file.flush()
+            os.fsync(file.fileno())
+        with contextlib.suppress(FileNotFoundError):
+            # mkstemp creates the file private to the owner; keep the original's permissions
+            os.chmod(temp_path, os.stat(file_path).st_mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+def file_identity(file_path):
+    """Return a value that changes whenever ``file_path`` is rewritten (None if it is missing)."""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class FileLock:
+    """Exclusive lock on a file shared by threads and processes.
+
+    Processes coordinate through an advisory lock on ``<path>.lock`` (flock,
+    or msvcrt on Windows); threads of one process queue on an in-process lock
+    first.  The lock is re-entrant, so code holding it can call functions that
+    take it again.  Use it as a context manager.
+    """
+
+    def __init__(self, path):
+        self.lock_path = path + ".lock"
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.lock_path, "a+")
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+
+# Task ids
+#
+# Every task carries an "id": a ULID-style string of 26 Crockford base32
+# characters (48-bit millisecond timestamp + 80 random bits).  Ids are unique
+# without coordination between processes and sort by creation time.
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_id_lock = threading.Lock()
+_last_id_time = 0
+_last_id_random = 0
+
+def new_task_id():
+    """Return a new task id; ids made by one process are strictly increasing."""
+    global _last_id_time, _last_id_random
+    with _id_lock:
+        now = int(time.time() * 1000)
+        if now <= _last_id_time:
+            # Same millisecond (or the clock went back): keep ordering by bumping the random part
+            now, random_part = _last_id_time, _last_id_random + 1
+        else:
+            random_part = secrets.randbits(80)
+        _last_id_time, _last_id_random = now, random_part
+    value = (now << 80) | random_part
+    return "".join(_CROCKFORD[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+def backfill_task_ids(tasks):
+    """Give every task in ``{username: [task, ...]}`` a unique id, in place.
+
+    Tasks saved before ids existed get a fresh one, as does any task whose id
+    is not a string (ids are addressed as strings everywhere) or is already
+    used by an earlier task of the same user.  Returns the usernames
+    whose lists changed, so the caller can persist them.
+    """
+    changed = []
+    for username, user_tasks in tasks.items():
+        seen = set()
+        for position, task in enumerate(user_tasks):
+            task_id = task.get("id")
+            if not task_id or not isinstance(task_id, str) or task_id in seen:
+                task = user_tasks[position] = {**task, "id": new_task_id()}
+                if not changed or changed[-1] != username:
+                    changed.append(username)
+            seen.add(task["id"])
+    return changed
+
+
+# Mutation records
+#
+# Every change the task store makes is described by a small dict so it can be
+# appended to a journal and replayed later:
+#   {"op": "add", "user": ..., "task": {...}}
+#   {"op": "edit", "user": ..., "id": ..., "changes": {...}}
+#   {"op": "remove", "user": ..., "id": ...}
+#   {"op": "replace_user", "user": ..., "tasks": [...]}
+# Edits and removals address a task by id.  Records written before tasks had
+# ids carry a "name" instead and address the first task with that name.
+# replace_user swaps in a user's whole list.
+
+def apply_op(tasks, op):
+    """Apply one mutation record to a ``{username: [task, ...]}`` dict in place."""
+    kind = op["op"]
+    if kind == "add":
+        tasks.setdefault(op["user"], []).append(op["task"])
+    elif kind in ("edit", "remove"):
+        field, value = ("id", op["id"]) if "id" in op else ("name", op["name"])
+        user_tasks = tasks.get(op["user"], [])
+        for position, task in enumerate(user_tasks):
+            if task.get(field) == value:
+                if kind == "edit":
+                    user_tasks[position] = {**task, **op["changes"]}
+                else:
+                    del user_tasks[position]
+                break
+    elif kind == "replace_user":
+        tasks[op["user"]] = list(op["tasks"])
+    else:
+        raise ValueError(f"Unknown journal operation: {kind!r}")
+
+
+class TaskRepository:
+    """Interface shared by the task storage backends.
+
+    ``load()`` returns the whole dataset as ``{username: [task, ...]}``.
+    ``persist(ops)`` makes a batch of mutation records durable.  Records are
+    applied to what storage holds at the time of the write, so several
+    processes can share one repository without overwriting each other's
+    changes.
+
+    ``load_user(username)`` returns just one user's list.  Backends that set
+    ``lazy`` keep users apart (see ``ShardedJsonRepository``); the store then
+    never calls ``load()`` and reads each user on first use instead.
+
+    ``lock(username)`` returns a context manager that excludes every other
+    writer of that user's data, in this and in other processes, for as long
+    as it is held.  ``version(username)`` returns a cheap value that changes
+    when that data is modified, so a process can tell when its in-memory copy
+    has gone stale.  Backends that keep everything together ignore
+    ``username``.
+    """
+
+    lazy = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def load_user(self, username):
+        return self.load().get(username, [])
+
+    def persist(self, ops):
+        raise NotImplementedError
+
+    def lock(self, username=None):
+        return contextlib.nullcontext()
+
+    def version(self, username=None):
+        return None
+
+    def close(self):
+        pass
+
+
+class JsonFileRepository(TaskRepository):
+    """The original storage: the whole dataset in one JSON file.
+
+    The repository keeps a copy of what the file holds, applies each batch of
+    mutation records to it and rewrites the file, all under the file lock.
+    If another process changed the file since, it is read again first, so
+    that process's changes are kept rather than overwritten.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file_lock = FileLock(file_path)
+        self._data = None
+        self._version = None
+
+    def load(self):
+        with self._file_lock:
+            self._read()
+            return {username: list(tasks) for username, tasks in self._data.items()}
+
+    def persist(self, ops):
+        if not ops:
+            return
+        with self._file_lock:
+            if self._data is None or self.version() != self._version:
+                self._read()
+            try:
+                for op in ops:
+                    apply_op(self._data, op)
+                save_data(self.file_path, self._data)
+            except BaseException:
+                # The copy may now be ahead of the file; read it again next time
+                self._data = None
+                raise
+            self._version = self.version()
+
+    def load_user(self, username):
+        with self._file_lock:
+            if self._data is None or self.version() != self._version:
+                self._read()
+            return list(self._data.get(username, []))
+
+    def lock(self, username=None):
+        return self._file_lock
+
+    def version(self, username=None):
+        return file_identity(self.file_path)
+
+    def _read(self):
+        self._version = self.version()
+        self._data = load_data(self.file_path)
+
+
+class JournalRepository(TaskRepository):
+    """Snapshot file plus an append-only journal of mutation records.
+
+    Each flush appends one compact JSON line per mutation to ``<snapshot>.journal``,
+    so the cost of a write depends on the size of the change rather than the size
+    of the dataset.  Once the journal grows past ``compact_bytes`` it is rotated
+    and a background thread folds it into a new snapshot.  ``load()`` replays the
+    snapshot followed by the journal.
+
+    Compaction is crash safe.  The rotated journal is only deleted after the new
+    snapshot has been fully written (to ``<snapshot>.next``), and ``load()``
+    finishes or discards a compaction that was interrupted part way.
+
+    Appends, rotation and the final swap of a compaction happen under the file
+    lock, so several processes can share one journal.
+    """
+
+    def __init__(self, snapshot_path, compact_bytes=1024 * 1024, fsync=True):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + ".journal"
+        self.folding_path = snapshot_path + ".journal.folding"
+        self.next_snapshot_path = snapshot_path + ".next"
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(snapshot_path)
+        self._journal = None
+        self._journal_size = 0
+        self._compactor = None
+
+    def load(self):
+        # Under the file lock: replay truncates torn records, which must not race another writer
+        with self._file_lock:
+            self._recover_compaction()
+            tasks = load_data(self.snapshot_path)
+            self._replay(self.folding_path, tasks)
+            self._replay(self.journal_path, tasks)
+            # Resume an interrupted compaction in the background
+            if os.path.exists(self.folding_path):
+                self._start_compactor()
+        return tasks
+
+    def persist(self, ops):
+        if not ops:
+            return
+        lines = b"".join(codec.dumps(op) + b"\n" for op in ops)
+        with self._lock, self._file_lock:
+            self._open_journal()
+            size = os.fstat(self._journal.fileno()).st_size
+            if size != self._journal_size and not self._ends_with_newline(size):
+                # Another process died part way through a record; keep ours on a line of its own
+                lines = b"\n" + lines
+            self._journal.write(lines)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._journal_size = self._journal.tell()
+            if self._journal_size >= self.compact_bytes and not os.path.exists(self.folding_path):
+                # Rotate under the lock; new mutations go to a fresh journal while the old one is folded
+                self._journal.close()
+                self._journal = None
+                os.replace(self.journal_path, self.folding_path)
+                self._start_compactor()
+
+    def lock(self, username=None):
+        return self._file_lock
+
+    def version(self, username=None):
+        return (file_identity(self.snapshot_path), file_identity(self.journal_path))
+
+    def compact(self):
+        """Fold the rotated journal into the snapshot (normally run in the background)."""
+        folding = file_identity(self.folding_path)
+        snapshot = file_identity(self.snapshot_path)
+        tasks = load_data(self.snapshot_path)
+        self._replay(self.folding_path, tasks)
+        with self._file_lock:
+            if file_identity(self.folding_path) != folding or file_identity(self.snapshot_path) != snapshot:
+                # Another process finished this compaction first
+                return
+            with open(self.next_snapshot_path, "wb") as file:
+                file.write(codec.dumps(tasks))
+                file.flush()
+                os.fsync(file.fileno())
+            # From here on .next is complete, so dropping the folded journal is safe
+            os.remove(self.folding_path)
+            os.replace(self.next_snapshot_path, self.snapshot_path)
+
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _open_journal(self):
+        try:
+            current = os.stat(self.journal_path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._journal is not None and os.fstat(self._journal.fileno()).st_ino != current:
+            # Another process rotated the journal since we opened it
+            self._journal.close()
+            self._journal = None
+        if self._journal is None:
+            self._journal = open(self.journal_path, "ab")
+            self._journal_size = os.fstat(self._journal.fileno()).st_size
+
+    def _ends_with_newline(self, size):
+        if size == 0:
+            return True
+        with open(self.journal_path, "rb") as file:
+            file.seek(size - 1)
+            return file.read(1) == b"\n"
+
+    def _start_compactor(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._run_compactor, name="task-journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def _run_compactor(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Journal compaction of %s failed; it will be retried on next load", self.snapshot_path)
+
+    def _recover_compaction(self):
+        if not os.path.exists(self.next_snapshot_path):
+            return
+        try:
+            load_data(self.next_snapshot_path)
+        except ValueError:
+            # Crashed while writing .next: the folded journal is still there, just start over
+            os.remove(self.next_snapshot_path)
+            return
+        # .next is complete and already contains the folded journal
+        if os.path.exists(self.folding_path):
+            os.remove(self.folding_path)
+        os.replace(self.next_snapshot_path, self.snapshot_path)
+
+    def _replay(self, path, tasks):
+        try:
+            file = open(path, "rb+")
+        except FileNotFoundError:
+            return
+        with file:
+            good_offset = 0
+            for line in iter(file.readline, b""):
+                if not line.endswith(b"\n"):
+                    # A torn final record from a crash mid-append. It was never acknowledged
+                    # (the append is fsynced before the write returns), so drop it.
+                    logger.warning("Dropping incomplete record at the end of %s", path)
+                    file.truncate(good_offset)
+                    break
+                good_offset = file.tell()
+                try:
+                    op = codec.loads(line)
+                except ValueError:
+                    # A torn record another process left behind before later records were appended
+                    logger.warning("Skipping unreadable record in %s", path)
+                    continue
+                apply_op(tasks, op)
+
+
+class SqliteRepository(TaskRepository):
+    """Tasks stored one row per task in an SQLite database.
+
+    The full task is kept as JSON in ``data``; the fields used for lookups and
+    filtering are copied into their own indexed columns.  The database runs in
+    WAL mode so readers never block the writer, and SQLite's own locking keeps
+    writers in different processes apart.  Row ids preserve insertion
+    order, which is the order tasks are returned in.
+
+    When the database is created and ``import_from`` names an existing JSON
+    tasks file, that file is imported once.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            task_id TEXT,
+            name TEXT,
+            priority TEXT,
+            due_date TEXT,
+            completed INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_username_task_id ON tasks (username, task_id);
+        CREATE INDEX IF NOT EXISTS tasks_username_name ON tasks (username, name);
+        CREATE INDEX IF NOT EXISTS tasks_username_priority ON tasks (username, priority);
+        CREATE INDEX IF NOT EXISTS tasks_username_completed ON tasks (username, completed);
+        CREATE INDEX IF NOT EXISTS tasks_username_due_date ON tasks (username, due_date);
+    """
+
+    def __init__(self, db_path, import_from=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(db_path)
+        created = not os.path.exists(db_path)
+        # The store persists from its flusher thread; access is serialized by self._lock.
+        # Other processes may hold the write lock briefly, so wait for it rather than failing.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")]
+        if columns and "task_id" not in columns:
+            # Databases created before tasks had ids
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN task_id TEXT")
+        self._conn.executescript(self.SCHEMA)
+        if created and import_from and os.path.exists(import_from):
+            data = load_data(import_from)
+            self.persist([{"op": "replace_user", "user": username, "tasks": tasks} for username, tasks in data.items()])
+
+    def load(self):
+        tasks = {}
+        with self._lock:
+            for username, data in self._conn.execute("SELECT username, data FROM tasks ORDER BY id"):
+                tasks.setdefault(username, []).append(codec.loads(data))
+        return tasks
+
+    def persist(self, ops):
+        with self._lock, self._conn:
+            for op in ops:
+                kind = op["op"]
+                if kind == "add":
+                    self._insert(op["user"], op["task"])
+                elif kind in ("edit", "remove"):
+                    column, value = ("task_id", op["id"]) if "id" in op else ("name", op["name"])
+                    row = self._conn.execute(
+                        f"SELECT id, data FROM tasks WHERE username = ? AND {column} = ? ORDER BY id LIMIT 1",
+                        (op["user"], value),
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    if kind == "edit":
+                        task = {**codec.loads(row[1]), **op["changes"]}
+                        self._conn.execute(
+                            "UPDATE tasks SET task_id = ?, name = ?, priority = ?, due_date = ?, completed = ?, data = ? WHERE id = ?",
+                            self._columns(task) + (codec.dumps(task).decode(), row[0]),
+                        )
+                    else:
+                        self._conn.execute("DELETE FROM tasks WHERE id = ?", (row[0],))
+                elif kind == "replace_user":
+                    self._conn.execute("DELETE FROM tasks WHERE username = ?", (op["user"],))
+                    for task in op["tasks"]:
+                        self._insert(op["user"], task)
+                else:
+                    raise ValueError(f"Unknown journal operation: {kind!r}")
+
+    def load_user(self, username):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM tasks WHERE username = ? ORDER BY id", (username,))
+            return [codec.loads(data) for data, in rows]
+
+    def lock(self, username=None):
+        return self._file_lock
+
+    def version(self, username=None):
+        # Changes whenever another connection commits; our own commits leave it alone
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _insert(self, username, task):
+        self._conn.execute(
+            "INSERT INTO tasks (username, task_id, name, priority, due_date, completed, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (username,) + self._columns(task) + (codec.dumps(task).decode(),),
+        )
+
+    @staticmethod
+    def _columns(task):
+        # Only strings go into the TEXT columns (anything else is NULL there and
+        # kept in data), so no task's content can make a write fail
+        text = [task.get(field) for field in ("id", "name", "priority", "due_date")]
+        completed = task.get("completed")
+        completed = None if completed is None else int(bool(completed))
+        return tuple(value if isinstance(value, str) else None for value in text) + (completed,)
+
+
+class ShardedJsonRepository(TaskRepository):
+    """Tasks split over many small JSON files in ``directory``, one per user.
+
+    Each shard file holds ``{username: [task, ...]}`` like tasks.json does,
+    but only for the users whose name hashes to it.  By default every user
+    gets a file of their own; with ``buckets`` set, users are spread over that
+    many files instead (fewer files, at the cost of rewriting a few other
+    users' tasks along with each change).
+
+    A change rewrites only the shard it touches, under that shard's own file
+    lock, so I/O per request scales with one user's data and writers for
+    different users never wait for each other.  Users are loaded lazily, one
+    shard at a time (see ``TaskRepository.lazy``).
+
+    When the directory is created and ``import_from`` names an existing JSON
+    tasks file, that file is split into shards once.
+    """
+
+    lazy = True
+
+    def __init__(self, directory, buckets=0, import_from=None):
+        self.directory = directory
+        self.buckets = buckets
+        self._lock = threading.Lock()  # guards self._shards
+        self._shards = {}  # shard file path -> JsonFileRepository
+        created = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+        if created and import_from and os.path.exists(import_from):
+            data = load_data(import_from)
+            self.persist([{"op": "replace_user", "user": username, "tasks": tasks} for username, tasks in data.items()])
+
+    def shard_path(self, username):
+        """Return the file holding ``username``'s tasks."""
+        digest = hashlib.sha256(username.encode()).hexdigest()
+        name = format(int(digest, 16) % self.buckets, "04x") if self.buckets else digest[:32]
+        return os.path.join(self.directory, name + ".json")
+
+    def load(self):
+        tasks = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                tasks.update(self._shard_at(os.path.join(self.directory, name)).load())
+        return tasks
+
+    def load_user(self, username):
+        return self._shard(username).load_user(username)
+
+    def persist(self, ops):
+        by_shard = {}
+        for op in ops:
+            by_shard.setdefault(self.shard_path(op["user"]), []).append(op)
+        for path, shard_ops in by_shard.items():
+            self._shard_at(path).persist(shard_ops)
+
+    def lock(self, username=None):
+        if username is None:
+            raise ValueError("Sharded storage can only be locked one user at a time")
+        return self._shard(username).lock()
+
+    def version(self, username=None):
+        if username is None:
+            return None
+        return self._shard(username).version()
+
+    def _shard(self, username):
+        return self._shard_at(self.shard_path(username))
+
+    def _shard_at(self, path):
+        with self._lock:
+            shard = self._shards.get(path)
+            if shard is None:
+                shard = self._shards[path] = JsonFileRepository(path)
+            return shard
+
+
+# Storage backends selectable by name
+REPOSITORIES = {
+    "json": JsonFileRepository,
+    "journal": JournalRepository,
+    "sqlite": SqliteRepository,
+    "sharded": ShardedJsonRepository,
+}
+
+def open_repository(backend, file_path):
+    """Create the storage backend called ``backend`` for the tasks file ``file_path``.
+
+    The SQLite backend keeps its database next to the tasks file (tasks.json ->
+    tasks.db), the sharded backend a directory of shards (tasks.json ->
+    tasks.shards/).  Both import the tasks file the first time they are created.
+    """
+    if backend == "sqlite":
+        return SqliteRepository(os.path.splitext(file_path)[0] + ".db", import_from=file_path)
+    if backend == "sharded":
+        return ShardedJsonRepository(os.path.splitext(file_path)[0] + ".shards", import_from=file_path)
+    try:
+        repository_class = REPOSITORIES[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {backend!r}; expected one of {sorted(REPOSITORIES)}")
+    return repository_class(file_path)
@@ -0,0 +1,310 @@
+import asyncio
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+import metrics
+# The handlers, the task store and the auth cache are the Flask service's own,
+# so both apps serve the same data with the same request/response contract
+from task_microservice import (
+    DROPPED_EVENT, HEARTBEAT_EVENT, SSE_HEARTBEAT, TaskImport, broker, changes_response, export_tasks, format_event,
+    handle_login_request, open_event_stream, request_user_details, serve_task_request, start_wait_changes,
+    store, token_user,
+)
+
+# Threads running the (blocking) handlers: password checks, store access and
+# storage I/O. The event loop itself only moves bytes, so a single process can
+# hold thousands of open connections with a small, fixed number of threads.
+EXECUTOR_WORKERS = 16
+
+# Requests allowed to wait for an executor thread; beyond this the service
+# answers 503 rather than queueing without bound
+MAX_PENDING = 1024
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Path -> handler(body, Authorization header, If-None-Match header) returning
+# the response body and its encoded JSON
+ROUTES = {
+    "/login": lambda data, auth_header, if_none_match: encoded(handle_login_request(data)),
+    "/task": serve_task_request,
+}
+
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="task-asgi")
+_pending = None  # asyncio.Semaphore, created on the running loop
+
+
+# ASGI entry point: run with any ASGI server, e.g. "uvicorn task_asgi:app"
+async def app(scope, receive, send):
+    if scope["type"] == "http":
+        await handle_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+
+async def handle_http(scope, receive, send):
+    path = scope["path"]
+    if path == "/events" and scope["method"] == "GET":
+        return await handle_events(scope, receive, send)
+    if path == "/import" and scope["method"] == "POST":
+        return await handle_import(scope, receive, send)
+    if path == "/export" and scope["method"] == "GET":
+        return await handle_export(scope, send)
+    if path == "/metrics" and scope["method"] == "GET":
+        return await handle_metrics(send)
+    if path not in ROUTES:
+        return await send_json(send, 404, {"status": "failure", "notification": "Not found."})
+    if scope["method"] != "POST":
+        return await send_json(send, 405, {"status": "failure", "notification": "Method not allowed."})
+
+    body = await read_body(receive)
+    if body is None:
+        return await send_json(send, 413, {"status": "failure", "notification": "Request body too large."})
+    try:
+        data = codec.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return await send_json(send, 400, {"status": "failure", "notification": "Request body must be a JSON object."})
+
+    if pending_slots().locked():
+        return await send_json(send, 503, {"status": "failure", "notification": "Server busy, try again."})
+    loop = asyncio.get_running_loop()
+    if_none_match = header(scope, b"if-none-match")
+    if path == "/task" and data.get("wait_changes"):
+        # Long-poll: wait on the event loop, not in an executor thread
+        start = time.perf_counter()
+        response = await wait_changes(data, header(scope, b"authorization"))
+        payload = codec.dumps(response)
+        metrics.observe_request("wait_changes", response["status"], time.perf_counter() - start)
+    else:
+        async with pending_slots():
+            response, payload = await loop.run_in_executor(
+                executor, ROUTES[path], data, header(scope, b"authorization"), if_none_match
+            )
+
+    if "etag" not in response:
+        return await send_payload(send, 200, payload)
+    etag_header = [(b"etag", f'"{response["etag"]}"'.encode())]
+    if response["status"] == "not_modified" and if_none_match:
+        # A conditional HTTP request gets a bodiless 304
+        await send({"type": "http.response.start", "status": 304, "headers": etag_header})
+        return await send({"type": "http.response.body", "body": b""})
+    await send_payload(send, 200, payload, etag_header)
+
+def encoded(body):
+    return body, codec.dumps(body)
+
+# Requests waiting for or running in the executor hold one of these slots
+def pending_slots():
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(EXECUTOR_WORKERS + MAX_PENDING)
+    return _pending
+
+# wait_changes on the event loop. It spans several threads, so the caller times it as a whole
+# and its phases (authenticate, load) are recorded under "background". It holds a pending
+# slot only while it runs in the executor, so idle long-polls never crowd out other requests.
+async def wait_changes(data, auth_header):
+    loop = asyncio.get_running_loop()
+    user_details = request_user_details(data, auth_header)
+    async with pending_slots():
+        response, wait = await loop.run_in_executor(
+            executor, start_wait_changes, user_details, data.get("since"), data.get("timeout")
+        )
+    if wait is None:
+        return response
+    subscription, timeout = wait
+    ready = asyncio.Event()
+    subscription.on_ready = lambda: loop.call_soon_threadsafe(ready.set)
+    try:
+        if not subscription.poll() and not subscription.dropped and not subscription.closed:
+            try:
+                await asyncio.wait_for(ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        closed_by_shutdown = subscription.closed
+        subscription.close()
+    if closed_by_shutdown:
+        # The executor may already be stopped; the reply is an in-memory read
+        return changes_response(subscription.username, data.get("since"))
+    async with pending_slots():
+        return await loop.run_in_executor(executor, changes_response, subscription.username, data.get("since"))
+
+# Server-sent events, as GET /events in task_microservice.py. Each open stream
+# costs a subscription and a coroutine, no thread.
+async def handle_events(scope, receive, send):
+    since = header(scope, b"last-event-id") or query_param(scope, "since")
+    loop = asyncio.get_running_loop()
+    subscription, chunks = await loop.run_in_executor(executor, open_event_stream, request_token(scope), since)
+    if subscription is None:
+        status, body = chunks
+        return await send_json(send, status, body)
+
+    ready = asyncio.Event()
+    subscription.on_ready = lambda: loop.call_soon_threadsafe(ready.set)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        await send_chunk(send, "".join(chunks))
+        while not disconnected.done():
+            ready.clear()
+            events = subscription.poll()
+            if subscription.closed:
+                break  # Shutting down
+            if subscription.dropped:
+                await send_chunk(send, DROPPED_EVENT)
+                break
+            if events:
+                await send_chunk(send, "".join(format_event(event) for event in events))
+                continue
+            # Both futures stay pending past the timeout; asyncio.wait does not cancel them
+            waiter = asyncio.ensure_future(ready.wait())
+            await asyncio.wait([waiter, disconnected], timeout=SSE_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                waiter.cancel()
+                if not disconnected.done():
+                    await send_chunk(send, HEARTBEAT_EVENT)
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b""})
+    except OSError:
+        pass  # The client went away mid-write
+    finally:
+        disconnected.cancel()
+        subscription.close()
+
+# Bulk import, as POST /import in task_microservice.py. The body is parsed as it
+# arrives; only committing each chunk of tasks runs in the executor.
+async def handle_import(scope, receive, send):
+    username = token_user(request_token(scope))
+    if not username:
+        return await send_json(send, 401, {"status": "failure", "notification": "Invalid credentials."})
+
+    loop = asyncio.get_running_loop()
+    importer = TaskImport(username)
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            # Keep what was committed; there is no one left to answer
+            return
+        if importer.feed(message.get("body", b"")):
+            await loop.run_in_executor(executor, importer.commit)
+        if not message.get("more_body"):
+            break
+    importer.finish()
+    await loop.run_in_executor(executor, importer.commit)
+    await send_json(send, 200, importer.result())
+
+# Bulk export, as GET /export: each chunk of NDJSON is read in the executor
+async def handle_export(scope, send):
+    username = token_user(request_token(scope))
+    if not username:
+        return await send_json(send, 401, {"status": "failure", "notification": "Invalid credentials."})
+
+    loop = asyncio.get_running_loop()
+    chunks = export_tasks(username)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+    while True:
+        chunk = await loop.run_in_executor(executor, next, chunks, None)
+        if chunk is None:
+            break
+        await send_chunk(send, chunk)
+    await send({"type": "http.response.body", "body": b""})
+
+async def wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def send_chunk(send, data):
+    if isinstance(data, str):
+        data = data.encode()
+    await send({"type": "http.response.body", "body": data, "more_body": True})
+
+# Returns the request body, or None once it exceeds MAX_BODY_BYTES
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+# The session token of a streaming request: "Authorization: Bearer" header or ?token=
+def request_token(scope):
+    auth_header = header(scope, b"authorization") or ""
+    return auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else query_param(scope, "token")
+
+def query_param(scope, name):
+    values = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1")).get(name)
+    return values[0] if values else None
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+# Prometheus metrics, as GET /metrics
+async def handle_metrics(send):
+    if not metrics.ENABLED:
+        return await send_json(send, 404, {"status": "failure", "notification": "Metrics are disabled; set TASK_METRICS=1."})
+    text = metrics.registry.render().encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/plain; version=0.0.4"), (b"content-length", str(len(text)).encode())],
+    })
+    await send({"type": "http.response.body", "body": text})
+
+async def send_json(send, status, body, extra_headers=()):
+    await send_payload(send, status, codec.dumps(body), extra_headers)
+
+async def send_payload(send, status, payload, extra_headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            *extra_headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+# End event streams and long polls, flush pending task writes and stop the
+# executor when the server shuts down
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            broker.close()
+            executor.shutdown(wait=True)
+            store.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("task_asgi.app needs an ASGI server, e.g.: pip install uvicorn && uvicorn task_asgi:app")
+    print(f"JSON codec: {codec.NAME}")
+    uvicorn.run(app)
@@ -0,0 +1,330 @@
+import hashlib
+import http.client
+import logging
+import os
+import queue
+import threading
+import urllib.parse
+
+import codec
+from auth import hash_password, verify_password
+from storage import TaskRepository, apply_op, load_data, save_data
+
+logger = logging.getLogger(__name__)
+
+# Idle keep-alive connections kept per server
+MAX_IDLE_CONNECTIONS = 4
+
+# Seconds to wait for the server before treating it as unreachable
+REQUEST_TIMEOUT = 10
+
+# Queued changes are sent in batch requests of at most this many operations
+REPLAY_BATCH_SIZE = 100
+
+
+class ServerUnavailable(Exception):
+    """The task service could not be reached (or answered with a server error)."""
+
+
+class AuthenticationError(Exception):
+    """The server (or, offline, the cached login) rejected the credentials."""
+
+
+class HTTPSession:
+    """JSON POSTs to one server over a pool of keep-alive connections.
+
+    Connections are reused between requests; a request on a reused connection
+    the server has meanwhile closed is retried once on a new one.
+    """
+
+    def __init__(self, base_url, max_idle=MAX_IDLE_CONNECTIONS, timeout=REQUEST_TIMEOUT):
+        parts = urllib.parse.urlsplit(base_url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip("/")
+        self._timeout = timeout
+        self._idle = queue.LifoQueue(max_idle)
+
+    def post(self, path, body, token=None):
+        """POST ``body`` as JSON and return the decoded response; raises ServerUnavailable."""
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        payload = codec.dumps(body)
+        for attempt in range(2):
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = self._connection_class(self._host, self._port, timeout=self._timeout), False
+            try:
+                connection.request("POST", self._prefix + path, payload, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise ServerUnavailable(f"Cannot reach the task server: {error}") from error
+            self._release(connection, response)
+            if response.status >= 500:
+                raise ServerUnavailable(f"The task server answered {response.status}.")
+            try:
+                return codec.loads(data)
+            except ValueError as error:
+                raise ServerUnavailable("The task server sent an invalid response.") from error
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _release(self, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class TaskClient:
+    """The /login and /task API for one user, with the session token kept and renewed."""
+
+    def __init__(self, base_url):
+        self.session = HTTPSession(base_url)
+        self._credentials = None
+        self._token = None
+
+    def login(self, username, password):
+        response = self.session.post("/login", {"user_details": {"username": username, "password": password}})
+        if response.get("status") != "success":
+            raise AuthenticationError(response.get("notification") or "Invalid credentials.")
+        self._credentials = (username, password)
+        self._token = response["token"]
+
+    def remember(self, username, password):
+        """Sign in with these credentials when the server is next reached (offline start)."""
+        self._credentials = (username, password)
+
+    def task_request(self, body):
+        """Send a /task request; a rejected (expired) token is renewed once."""
+        if self._token is None and self._credentials:
+            self.login(*self._credentials)
+        response = self.session.post("/task", body, self._token)
+        if response.get("notification") == "Invalid credentials." and self._credentials:
+            self.login(*self._credentials)
+            response = self.session.post("/task", body, self._token)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class RemoteRepository(TaskRepository):
+    """One user's tasks on the task service, for the desktop app's remote mode.
+
+    ``login()`` signs in, sends any queued changes and fetches the user's
+    tasks (conditionally, with the etag from last time).  The tasks are
+    cached in ``cache_dir``, so ``load_user()`` answers from memory and the
+    app can start offline from the cache.
+
+    ``persist(ops)`` first appends the mutation records to a queue file in
+    ``cache_dir``, so they survive a crash or restart, then sends the queue
+    to the server as batch requests of REPLAY_BATCH_SIZE operations.  While
+    the server is unreachable the records stay queued; ``sync()`` tries again.
+    Neither method raises for an unreachable server: the changes are safe
+    on disk either way.
+
+    The server gives added tasks ids of its own.  ``persist()`` and ``sync()``
+    return ``{local id: server id}`` for the tasks they added, and queued
+    records that still use a local id are translated when they are sent.
+    A batch whose response is lost may be applied twice.
+    """
+
+    def __init__(self, base_url, cache_dir):
+        self.client = TaskClient(base_url)
+        self.cache_dir = cache_dir
+        self.username = None
+        self.offline = False
+        self._lock = threading.Lock()
+        self._password_hash = None
+        self._server_tasks = []  # the user's tasks as last seen on the server
+        self._etag = None
+        self._queue = []         # mutation records not yet sent
+        self._id_map = {}        # local task id -> server task id
+
+    def login(self, username, password):
+        """Sign in and bring the cache up to date; return True when working offline.
+
+        Raises AuthenticationError for wrong credentials.  When the server is
+        unreachable, a user who has logged in on this computer before is let
+        in against the cached login.
+        """
+        with self._lock:
+            self._load_cache(username)
+            try:
+                self.client.login(username, password)
+            except ServerUnavailable as error:
+                if self._password_hash is None:
+                    raise AuthenticationError(f"{error} There is no cached copy for this user.") from error
+                if not verify_password(self._password_hash, password):
+                    raise AuthenticationError("Invalid username or password.") from error
+                self.client.remember(username, password)
+                self.username = username
+                self.offline = True
+                return True
+
+            self.username = username
+            self.offline = False
+            if not verify_password(self._password_hash, password):
+                self._password_hash = hash_password(password)
+            self._replay()
+            self._refresh()
+            self._save_cache()
+            return self.offline
+
+    def load_user(self, username):
+        """Return the cached tasks with the queued changes applied."""
+        with self._lock:
+            if username != self.username:
+                return []
+            tasks = {username: list(self._server_tasks)}
+            for op in self._queue:
+                apply_op(tasks, self._translate(op))
+            return tasks[username]
+
+    def persist(self, ops):
+        with self._lock:
+            pending = self._queue + [op for op in ops if op["op"] in ("add", "edit", "remove")]
+            # On disk before anything is sent, so nothing is lost if sending fails halfway.
+            # If this write fails the queue is unchanged, so retrying the same records queues them once.
+            self._save_queue(pending)
+            self._queue = pending
+            return self._replay()
+
+    def sync(self):
+        """Send queued changes, if any; returns ``{local id: server id}`` like ``persist``."""
+        with self._lock:
+            return self._replay() if self._queue else {}
+
+    def pending(self):
+        """Return how many changes are waiting to be sent."""
+        with self._lock:
+            return len(self._queue)
+
+    def close(self):
+        self.client.close()
+
+    def _replay(self):
+        # A failed cache write is logged, not raised: the records are queued already, and a
+        # caller retrying persist() would queue them a second time
+        new_ids = {}
+        try:
+            self._send_queue(new_ids)
+        except OSError as error:
+            # The queue in memory is up to date; the files catch up on the next save
+            logger.warning("Cannot save the task cache: %s", error)
+        return new_ids
+
+    def _send_queue(self, new_ids):
+        sent = False
+        while self._queue and self.username:
+            # A batch ends before an operation on a task added in the same batch: its server id is not known yet
+            batch = []
+            added = set()
+            for op in self._queue[:REPLAY_BATCH_SIZE]:
+                if op.get("id") in added:
+                    break
+                batch.append(op)
+                if op["op"] == "add":
+                    added.add(op["task"]["id"])
+
+            try:
+                response = self.client.task_request({"batch": True, "operations": [self._operation(op) for op in batch]})
+            except ServerUnavailable:
+                self.offline = True
+                break
+            except AuthenticationError as error:
+                logger.warning("Cannot send queued changes: %s", error)
+                break
+            if response.get("status") != "success":
+                logger.warning("Server rejected queued changes: %s", response.get("notification"))
+                break
+
+            self.offline = False
+            sent = True
+            tasks = {self.username: self._server_tasks}
+            for op, result in zip(batch, response["results"]):
+                if result["status"] != "success":
+                    # E.g. the task was removed elsewhere meanwhile
+                    logger.warning("Server rejected a queued %s: %s", op["op"], result["notification"])
+                    continue
+                if op["op"] == "add":
+                    new_ids[op["task"]["id"]] = self._id_map[op["task"]["id"]] = result["task_id"]
+                apply_op(tasks, self._translate(op))
+            self._server_tasks = tasks[self.username]
+            self._etag = None  # the server's version has moved on
+            self._queue = self._queue[len(batch):]
+            self._save_queue(self._queue)
+        if sent:
+            self._save_cache()
+
+    def _refresh(self):
+        try:
+            response = self.client.task_request({"get_tasks": True, "if_none_match": self._etag})
+        except ServerUnavailable:
+            self.offline = True
+            return
+        if response.get("status") == "success":
+            self._server_tasks = response["tasks"]
+            self._etag = response.get("etag")
+        elif response.get("status") == "failure" and response.get("notification") == "No tasks found for this user.":
+            self._server_tasks = []
+
+    def _operation(self, op):
+        # A mutation record -> an operation of a /task batch request
+        if op["op"] == "add":
+            details = {field: value for field, value in op["task"].items() if field != "id"}
+            return {"add_task": True, "task_details": details}
+        task_id = self._id_map.get(op["id"], op["id"])
+        if op["op"] == "edit":
+            return {"edit_task": True, "task_id": task_id, "updated_task_details": op["changes"]}
+        return {"remove_task": True, "task_id": task_id}
+
+    def _translate(self, op):
+        # The record with the server's ids in place of local ones
+        if op["op"] == "add":
+            task_id = op["task"]["id"]
+            return {**op, "task": {**op["task"], "id": self._id_map.get(task_id, task_id)}}
+        return {**op, "id": self._id_map.get(op["id"], op["id"])}
+
+    def _cache_path(self, username, suffix=".json"):
+        return os.path.join(self.cache_dir, hashlib.sha256(username.encode()).hexdigest()[:32] + suffix)
+
+    def _load_cache(self, username):
+        cache = load_data(self._cache_path(username))
+        queued = load_data(self._cache_path(username, ".queue.json"))
+        self._password_hash = cache.get("password_hash")
+        self._server_tasks = cache.get("tasks", [])
+        self._etag = cache.get("etag")
+        self._queue = queued.get("queue", [])
+        # Only ids queued records may still use are worth remembering
+        referenced = {op["task"]["id"] if op["op"] == "add" else op["id"] for op in self._queue}
+        self._id_map = {local: remote for local, remote in queued.get("id_map", {}).items() if local in referenced}
+
+    def _save_cache(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_data(self._cache_path(self.username), {
+            "username": self.username,
+            "password_hash": self._password_hash,
+            "tasks": self._server_tasks,
+            "etag": self._etag,
+        })
+
+    def _save_queue(self, pending):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_data(self._cache_path(self.username, ".queue.json"), {"queue": pending, "id_map": self._id_map})
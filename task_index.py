@@ -0,0 +1,212 @@
+import base64
+import bisect
+import json
+
+# Filters understood by get_tasks:
+#   "priority":    a priority or a list of priorities
+#   "completed":   true / false (tasks without the field count as not completed)
+#   "due_from":    earliest due date, inclusive ("YYYY-MM-DD")
+#   "due_to":      latest due date, inclusive ("YYYY-MM-DD")
+#   "name_prefix": case-sensitive prefix of the task name
+FILTER_FIELDS = ("priority", "completed", "due_from", "due_to", "name_prefix")
+
+# Orders get_tasks can return tasks in.  None is the order tasks were added in.
+# Tasks without a value for the sort field come last; ties are broken by id.
+SORT_FIELDS = (None, "due_date", "timestamp", "priority")
+PRIORITY_RANK = {"High": 0, "Medium": 1, "Low": 2}
+
+
+def sort_key(sort_by, task, position):
+    """Return the key ``task`` (at list ``position``) sorts by in the ``sort_by`` order."""
+    if sort_by is None:
+        return position
+    value = task.get(sort_by)
+    if not isinstance(value, str):
+        return (9, "")
+    if sort_by == "priority":
+        # High, Medium, Low, then any other priority alphabetically
+        return (PRIORITY_RANK.get(value, 3), value)
+    return (0, value)
+
+
+# Cursors are opaque to clients: the sort order plus the (key, id) entry of the
+# last task returned.  Seeking by value rather than by offset means tasks added
+# or removed between requests never make a page skip or repeat a task.
+def encode_cursor(sort_by, entry):
+    return base64.urlsafe_b64encode(json.dumps([sort_by, entry]).encode()).decode()
+
+def decode_cursor(cursor, sort_by):
+    """Return the entry stored in ``cursor``; raises ValueError if it is not valid for ``sort_by``."""
+    try:
+        cursor_sort_by, (key, task_id) = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor.")
+    if cursor_sort_by != sort_by or not isinstance(task_id, str):
+        raise ValueError("Invalid cursor.")
+    # The key must have the shape sort_key gives: a position, or (rank, value)
+    if sort_by is None:
+        if not isinstance(key, int) or isinstance(key, bool):
+            raise ValueError("Invalid cursor.")
+        return (key, task_id)
+    if not (isinstance(key, list) and len(key) == 2 and type(key[0]) is int and isinstance(key[1], str)):
+        raise ValueError("Invalid cursor.")
+    return (tuple(key), task_id)
+
+
+def parse_filters(filters):
+    """Validate a filters object from a request; return a normalized dict.
+
+    Raises ValueError with a message suitable for the client.
+    """
+    if filters is None:
+        return {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object.")
+    unknown = sorted(set(filters) - set(FILTER_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(unknown)}.")
+    parsed = {}
+    if "priority" in filters:
+        priorities = filters["priority"]
+        if isinstance(priorities, str):
+            priorities = [priorities]
+        if not isinstance(priorities, list) or not all(isinstance(priority, str) for priority in priorities):
+            raise ValueError("priority must be a string or a list of strings.")
+        parsed["priority"] = set(priorities)
+    if "completed" in filters:
+        if not isinstance(filters["completed"], bool):
+            raise ValueError("completed must be true or false.")
+        parsed["completed"] = filters["completed"]
+    for field in ("due_from", "due_to", "name_prefix"):
+        if field in filters:
+            if not isinstance(filters[field], str):
+                raise ValueError(f"{field} must be a string.")
+            parsed[field] = filters[field]
+    return parsed
+
+
+def matches(task, filters):
+    """Return True if ``task`` satisfies every parsed filter."""
+    if "priority" in filters and task.get("priority") not in filters["priority"]:
+        return False
+    if "completed" in filters and bool(task.get("completed")) != filters["completed"]:
+        return False
+    if "due_from" in filters or "due_to" in filters:
+        due_date = task.get("due_date")
+        if not isinstance(due_date, str):
+            return False
+        if "due_from" in filters and due_date < filters["due_from"]:
+            return False
+        if "due_to" in filters and due_date > filters["due_to"]:
+            return False
+    if "name_prefix" in filters:
+        name = task.get("name")
+        if not isinstance(name, str) or not name.startswith(filters["name_prefix"]):
+            return False
+    return True
+
+
+class TaskIndex:
+    """Secondary indexes over one user's tasks, for filtering and sorting.
+
+    * priority buckets: priority -> set of task ids
+    * completion: the set of ids of completed tasks
+    * orderings: for each entry of ``SORT_FIELDS``, a sorted list of
+      ``(sort key, id)``; the due date ordering doubles as the index for due
+      date ranges
+    * names: a sorted list of ``(name, id)``, so a prefix is a bisect range
+
+    ``candidates()`` picks whichever index yields the fewest tasks for the
+    given filters, and only those tasks are checked against the rest of the
+    filters, so selective queries never scan the whole list.
+    """
+
+    def __init__(self):
+        self.by_priority = {}
+        self.completed = set()
+        self.orderings = {sort_by: [] for sort_by in SORT_FIELDS}
+        self.names = []
+
+    def add(self, task_id, task, position):
+        self.by_priority.setdefault(task.get("priority"), set()).add(task_id)
+        if task.get("completed"):
+            self.completed.add(task_id)
+        for sort_by, ordering in self.orderings.items():
+            bisect.insort(ordering, (sort_key(sort_by, task, position), task_id))
+        if isinstance(task.get("name"), str):
+            bisect.insort(self.names, (task["name"], task_id))
+
+    def add_many(self, entries):
+        """Add ``(task_id, task, position)`` entries, sorting each ordering once instead of per task."""
+        entries = list(entries)
+        for task_id, task, _ in entries:
+            self.by_priority.setdefault(task.get("priority"), set()).add(task_id)
+            if task.get("completed"):
+                self.completed.add(task_id)
+        for sort_by, ordering in self.orderings.items():
+            ordering.extend((sort_key(sort_by, task, position), task_id) for task_id, task, position in entries)
+            ordering.sort()
+        self.names.extend((task["name"], task_id) for task_id, task, _ in entries if isinstance(task.get("name"), str))
+        self.names.sort()
+
+    def remove(self, task_id, task, position):
+        bucket = self.by_priority[task.get("priority")]
+        bucket.discard(task_id)
+        if not bucket:
+            del self.by_priority[task.get("priority")]
+        self.completed.discard(task_id)
+        for sort_by, ordering in self.orderings.items():
+            _remove_sorted(ordering, (sort_key(sort_by, task, position), task_id))
+        if isinstance(task.get("name"), str):
+            _remove_sorted(self.names, (task["name"], task_id))
+
+    def candidates(self, filters, total):
+        """Return a small superset of the ids matching ``filters`` (None means every task).
+
+        ``total`` is the number of tasks; an index that would not rule out any
+        of them is not worth using.
+        """
+        options = []  # (number of ids, function producing them)
+        if "priority" in filters:
+            buckets = [self.by_priority.get(priority, set()) for priority in filters["priority"]]
+            options.append((sum(map(len, buckets)), lambda: set().union(*buckets)))
+        if filters.get("completed") is True:
+            options.append((len(self.completed), lambda: self.completed))
+        if "due_from" in filters or "due_to" in filters:
+            due_low, due_high = self._due_range(filters)
+            due_dates = self.orderings["due_date"]
+            options.append((due_high - due_low, lambda: [task_id for _, task_id in due_dates[due_low:due_high]]))
+        if "name_prefix" in filters:
+            name_low, name_high = _prefix_range(self.names, filters["name_prefix"])
+            options.append((name_high - name_low, lambda: [task_id for _, task_id in self.names[name_low:name_high]]))
+        if not options:
+            # Only "completed": false, or no filters at all
+            return None
+        size, produce = min(options, key=lambda option: option[0])
+        if size >= total:
+            return None
+        return produce()
+
+    def _due_range(self, filters):
+        # Tasks with a due date have keys (0, due_date) and sort before those without
+        due_dates = self.orderings["due_date"]
+        low = bisect.bisect_left(due_dates, ((0, filters.get("due_from", "")),))
+        high = bisect.bisect_left(due_dates, ((1,),))
+        if "due_to" in filters:
+            # Every ((0, due_to), id) entry sorts before ((0, due_to + "\0"),)
+            high = bisect.bisect_left(due_dates, ((0, filters["due_to"] + "\0"),))
+        return low, max(low, high)
+
+
+def _prefix_range(entries, prefix):
+    low = bisect.bisect_left(entries, (prefix,))
+    if not prefix or prefix[-1] == chr(0x10FFFF):
+        return low, len(entries)
+    # The first string that sorts after every string starting with prefix
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return low, bisect.bisect_left(entries, (upper,))
+
+def _remove_sorted(entries, entry):
+    position = bisect.bisect_left(entries, entry)
+    if position < len(entries) and entries[position] == entry:
+        del entries[position]
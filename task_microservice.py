@@ -1,130 +1,690 @@
 from flask import Flask, request, jsonify
-import json
+from flask.json.provider import DefaultJSONProvider
+import atexit
+import os
+import signal
+import sys
 from datetime import datetime
 
+import codec
+import metrics
+from auth import AuthCache, issue_token, verify_token
+from events import ChangeBroker
+from storage import open_repository
+from task_index import SORT_FIELDS, decode_cursor, encode_cursor, parse_filters
+from task_store import TaskStore
+
+# request.json and jsonify go through codec.py (orjson when it is installed)
+class CodecJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return codec.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Straight to bytes, skipping the round trip through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codec.dumps(obj), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 
 # File paths for storage
 TASKS_FILE = "tasks.json"
 USERS_FILE = "users.json"
 
-# Load data from files
-def load_data(file_path):
-    try:
-        with open(file_path, "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
+# Storage backend for tasks: "json" rewrites TASKS_FILE on every flush,
+# "journal" appends changes to TASKS_FILE.journal and compacts in the background,
+# "sqlite" keeps one indexed row per task in tasks.db, "sharded" keeps one small
+# JSON file per user in tasks.shards/ and reads each user only when first needed
+STORAGE_BACKEND = os.environ.get("TASK_STORAGE_BACKEND", "json")
+
+# Write-behind policy: flush every FLUSH_INTERVAL_MS or after FLUSH_EVERY mutations
+FLUSH_INTERVAL_MS = 500
+FLUSH_EVERY = 100
+
+# Set when other processes write the same storage (several workers, the desktop
+# app): writes then go straight to disk under a file lock, and the tasks are
+# reloaded whenever another process changed them. serve.py turns this on for
+# its workers through TASK_SHARED_STORAGE.
+SHARED_STORAGE = os.environ.get("TASK_SHARED_STORAGE") == "1"
+
+# Changes remembered per user for get_changes; clients further behind get a full reload
+CHANGE_LOG_SIZE = 1000
+
+# Tasks are loaded once and served from memory; pending writes are flushed on exit
+store = TaskStore(
+    metrics.timed_repository(open_repository(STORAGE_BACKEND, TASKS_FILE)),
+    flush_interval_ms=FLUSH_INTERVAL_MS,
+    flush_every=FLUSH_EVERY,
+    shared=SHARED_STORAGE,
+    change_log_size=CHANGE_LOG_SIZE,
+)
+atexit.register(store.close)
+
+# Push channel (/events and wait_changes): each commit is published to the user's
+# subscribers. A subscriber more than EVENT_QUEUE_SIZE events behind is dropped
+# and told to resynchronize; at most MAX_SUBSCRIBERS streams can be open at once.
+EVENT_QUEUE_SIZE = 100
+MAX_SUBSCRIBERS = 10000
+broker = ChangeBroker(queue_size=EVENT_QUEUE_SIZE, max_subscribers=MAX_SUBSCRIBERS)
+store.add_commit_listener(lambda username, etag, changes: broker.publish(username, {"etag": etag, "changes": changes}))
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_HEARTBEAT = 15
+
+# How long wait_changes waits for a change by default, and at most
+LONG_POLL_TIMEOUT = 30
+LONG_POLL_MAX = 60
+
+# Successful logins are remembered for AUTH_CACHE_TTL seconds (LRU of AUTH_CACHE_SIZE entries);
+# users.json is only re-read when it changes on disk
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_SIZE = 1024
+auth_cache = AuthCache(USERS_FILE, ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_SIZE)
+
+# Lifetime of session tokens issued by /login, in seconds
+TOKEN_TTL = 900
 
-# Save data to files
-def save_data(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
+# Largest page get_tasks returns when a limit is given
+MAX_PAGE_SIZE = 1000
 
-# Authentication
+# Most operations a single batch request may carry
+MAX_BATCH_SIZE = 10000
+
+# Task fields the store indexes; when given, they must be strings
+INDEXED_FIELDS = ("name", "priority", "due_date")
+
+# Bulk import / export (/import, /export) stream NDJSON, one task per line.
+# Imports are committed IMPORT_CHUNK_SIZE tasks at a time and exports read
+# EXPORT_CHUNK_SIZE tasks at a time, so memory use does not grow with the
+# number of tasks. Longer lines than MAX_IMPORT_LINE_BYTES are skipped; an
+# import reports at most MAX_IMPORT_ERRORS of the lines it skipped.
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_LINE_BYTES = 1024 * 1024
+MAX_IMPORT_ERRORS = 100
+
+# Authentication: returns the authenticated username, or None
 def authenticate(user_details):
-    users = load_data(USERS_FILE)
+    with metrics.phase("authenticate"):
+        return check_credentials(user_details)
+
+def check_credentials(user_details):
     username = user_details.get("username")
-    password = user_details.get("password")
+    
+    # A session token from /login is checked with a single HMAC, no file or password hashing
+    token = user_details.get("token")
+    if token:
+        token_user = verify_token(token)
+        if token_user is None or (username and username != token_user):
+            return None
+        return token_user
     
     # Ensure the user exists and password matches
-    if username in users and users[username] == password:
-        return True
-    return False
+    if auth_cache.verify(username, user_details.get("password")):
+        return username
+    return None
+
+# The failure reply for task details with a non-string indexed field, else None
+def invalid_fields(task_details):
+    for field in INDEXED_FIELDS:
+        if field in task_details and not isinstance(task_details[field], str):
+            return {"status": "failure", "notification": f"{field} must be a string."}
+    return None
+
+# The mutations behind add_task / edit_task / remove_task and batch.
+# txn is a task_store.Transaction for the authenticated user.
+def apply_add(txn, task_details):
+    if not isinstance(task_details, dict):
+        return {"status": "failure", "notification": "Invalid task details."}
+    failure = invalid_fields(task_details)
+    if failure:
+        return failure
+    
+    # Add timestamp and append to the user's task list
+    task_details["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    task_id = txn.add_task(task_details)
+    
+    return {"status": "success", "notification": "Task added successfully.", "task_id": task_id}
+
+# The task an edit / remove addresses: task_id, else the oldest task called task_name.
+# Ids are strings; any other task_id addresses no task.
+def resolve_task(txn, task_name, task_id):
+    if task_id:
+        return task_id if isinstance(task_id, str) else None
+    return txn.find_task(task_name) if isinstance(task_name, str) else None
+
+def apply_edit(txn, task_name, updated_task_details, task_id=None):
+    if not isinstance(updated_task_details, dict):
+        return {"status": "failure", "notification": "Invalid task details."}
+    failure = invalid_fields(updated_task_details)
+    if failure:
+        return failure
+    
+    if not txn.has_tasks():
+        return {"status": "failure", "notification": "No tasks found for this user."}
+    
+    task_id = resolve_task(txn, task_name, task_id)
+    if task_id and txn.edit_task(task_id, updated_task_details):
+        return {"status": "success", "notification": "Task updated successfully."}
+    
+    return {"status": "failure", "notification": "Task not found."}
+
+def apply_remove(txn, task_name, task_id=None):
+    if not txn.has_tasks():
+        return {"status": "failure", "notification": "No tasks found for this user."}
+    
+    task_id = resolve_task(txn, task_name, task_id)
+    if task_id and txn.remove_task(task_id):
+        return {"status": "success", "notification": "Task removed successfully."}
+    
+    return {"status": "failure", "notification": "Task not found."}
+
+# One operation of a batch, in the same format as a single /task request
+def apply_operation(txn, operation):
+    if not isinstance(operation, dict):
+        return {"status": "failure", "notification": "Invalid operation."}
+    
+    if operation.get("add_task"):
+        return apply_add(txn, operation.get("task_details"))
+    
+    elif operation.get("edit_task"):
+        return apply_edit(txn, operation.get("task_name"), operation.get("updated_task_details"), operation.get("task_id"))
+    
+    elif operation.get("remove_task"):
+        return apply_remove(txn, operation.get("task_name"), operation.get("task_id"))
+    
+    return {"status": "failure", "notification": "Invalid operation."}
 
 # Add Task
 def add_task(task_details, user_details):
-    if not authenticate(user_details):
+    username = authenticate(user_details)
+    if not username:
         return {"status": "failure", "notification": "Invalid credentials."}
     
-    tasks = load_data(TASKS_FILE)
-    username = user_details["username"]
-    
-    # Initialize tasks for user if they don't exist
-    if username not in tasks:
-        tasks[username] = []
+    with store.transaction(username) as txn:
+        return apply_add(txn, task_details)
+
+# Edit Task: addressed by task_id, or by task_name (the user's oldest task with that name)
+def edit_task(task_name, updated_task_details, user_details, task_id=None):
+    username = authenticate(user_details)
+    if not username:
+        return {"status": "failure", "notification": "Invalid credentials."}
     
-    # Add timestamp and append to the user's task list
-    task_details["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    tasks[username].append(task_details)
-    save_data(TASKS_FILE, tasks)
+    with store.transaction(username) as txn:
+        return apply_edit(txn, task_name, updated_task_details, task_id)
+
+# Remove Task: addressed by task_id, or by task_name (the user's oldest task with that name)
+def remove_task(task_name, user_details, task_id=None):
+    username = authenticate(user_details)
+    if not username:
+        return {"status": "failure", "notification": "Invalid credentials."}
     
-    return {"status": "success", "notification": "Task added successfully."}
+    with store.transaction(username) as txn:
+        return apply_remove(txn, task_name, task_id)
 
-# Edit Task
-def edit_task(task_name, updated_task_details, user_details):
-    if not authenticate(user_details):
+# Batch: a list of add/edit/remove operations, authenticated once, applied in order
+# against the same state and persisted in a single write. With atomic set, either
+# every operation succeeds or none of them is applied.
+def batch(operations, user_details, atomic=False):
+    username = authenticate(user_details)
+    if not username:
         return {"status": "failure", "notification": "Invalid credentials."}
     
-    tasks = load_data(TASKS_FILE)
-    username = user_details["username"]
+    if not isinstance(operations, list) or not operations:
+        return {"status": "failure", "notification": "operations must be a non-empty list."}
     
-    if username not in tasks or not tasks[username]:
-        return {"status": "failure", "notification": "No tasks found for this user."}
+    if len(operations) > MAX_BATCH_SIZE:
+        return {"status": "failure", "notification": f"A batch can hold at most {MAX_BATCH_SIZE} operations."}
     
-    for task in tasks[username]:
-        if task["name"] == task_name:
-            task.update(updated_task_details)
-            save_data(TASKS_FILE, tasks)
-            return {"status": "success", "notification": "Task updated successfully."}
+    results = []
+    rolled_back = False
+    with store.transaction(username) as txn:
+        for operation in operations:
+            result = apply_operation(txn, operation)
+            results.append(result)
+            if atomic and result["status"] == "failure":
+                txn.rollback()
+                rolled_back = True
+                break
     
-    return {"status": "failure", "notification": "Task not found."}
+    if rolled_back:
+        # Report what happened to every operation: undone, the one that failed, never attempted
+        undone = [{"status": "failure", "notification": "Rolled back."}] * (len(results) - 1)
+        not_attempted = [{"status": "failure", "notification": "Not attempted."}] * (len(operations) - len(results))
+        return {
+            "status": "failure",
+            "notification": "Batch rolled back: an operation failed.",
+            "results": undone + [results[-1]] + not_attempted,
+        }
+    
+    applied = sum(result["status"] == "success" for result in results)
+    return {
+        "status": "success",
+        "notification": f"{applied} of {len(operations)} operations applied.",
+        "results": results,
+    }
 
-# Remove Task
-def remove_task(task_name, user_details):
-    if not authenticate(user_details):
+# Retrieve Tasks, optionally filtered (see task_index.py for the supported filters),
+# sorted by sort_by and paged with limit / cursor. The response carries an etag;
+# sending it back as if_none_match gets a short "not_modified" reply for as long
+# as the user's tasks are unchanged.
+def get_tasks(user_details, filters=None, limit=None, cursor=None, sort_by=None, if_none_match=None):
+    username = authenticate(user_details)
+    if not username:
         return {"status": "failure", "notification": "Invalid credentials."}
     
-    tasks = load_data(TASKS_FILE)
-    username = user_details["username"]
+    try:
+        filters = parse_filters(filters)
+    except ValueError as error:
+        return {"status": "failure", "notification": f"Invalid filters: {error}"}
     
-    if username not in tasks or not tasks[username]:
-        return {"status": "failure", "notification": "No tasks found for this user."}
+    if sort_by not in SORT_FIELDS:
+        return {"status": "failure", "notification": "sort_by must be one of due_date, timestamp or priority."}
     
-    for task in tasks[username]:
-        if task["name"] == task_name:
-            tasks[username].remove(task)
-            save_data(TASKS_FILE, tasks)
-            return {"status": "success", "notification": "Task removed successfully."}
+    paged = limit is not None or cursor is not None
+    if paged and (not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PAGE_SIZE):
+        return {"status": "failure", "notification": f"limit must be a number from 1 to {MAX_PAGE_SIZE}."}
     
-    return {"status": "failure", "notification": "Task not found."}
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, sort_by)
+        except ValueError as error:
+            return {"status": "failure", "notification": str(error)}
+    
+    # Read before the tasks: if they change in between, the etag is the older one and the next poll refetches
+    etag = store.version(username)
+    if if_none_match == etag:
+        return {"status": "not_modified", "etag": etag}
+    
+    user_tasks, last = store.get_page(username, filters, sort_by, after, limit)
+    
+    response = {"status": "success", "tasks": user_tasks, "etag": etag}
+    if paged:
+        response["next_cursor"] = encode_cursor(sort_by, last) if last is not None else None
+    return response
 
-# Retrieve Tasks
-def get_tasks(user_details):
-    if not authenticate(user_details):
+# Changes since a version: only the tasks added, edited or removed after the etag
+# "since" (from get_tasks or an earlier get_changes). Removed tasks come back as
+# {"id": ..., "deleted": true}. When the server can no longer tell what changed
+# (change log overflowed, server restarted) the reply is "reset" and the client
+# should fetch the full list with get_tasks.
+def get_changes(user_details, since):
+    username = authenticate(user_details)
+    if not username:
         return {"status": "failure", "notification": "Invalid credentials."}
     
-    tasks = load_data(TASKS_FILE)
-    username = user_details["username"]
-    user_tasks = tasks.get(username, [])
+    if not isinstance(since, str):
+        return {"status": "failure", "notification": "since must be an etag from get_tasks or get_changes."}
     
-    return {"status": "success", "tasks": user_tasks}
+    return changes_response(username, since)
 
-@app.route("/task", methods=["POST"])
-def task_handler():
-    data = request.json
+def changes_response(username, since):
+    changes, etag = store.changes_since(username, since)
+    if changes is None:
+        return {
+            "status": "reset",
+            "notification": "Changes since this version are no longer available; fetch all tasks.",
+            "etag": etag,
+        }
+    
+    return {"status": "success", "changes": changes, "etag": etag}
+
+# Long-poll: like get_changes, but when nothing has changed since "since" yet, the
+# reply waits up to "timeout" seconds for the next change
+def wait_changes(user_details, since, timeout=None):
+    response, wait = start_wait_changes(user_details, since, timeout)
+    if wait is None:
+        return response
+    subscription, timeout = wait
+    with subscription:
+        subscription.wait(timeout)
+    return changes_response(subscription.username, since)
+
+# The first half of wait_changes, for callers that wait on the subscription
+# themselves (task_asgi.py). Returns (response, None) when the reply is ready
+# now, else (None, (subscription, timeout)); the caller waits, closes the
+# subscription and replies with changes_response(subscription.username, since).
+def start_wait_changes(user_details, since, timeout=None):
+    username = authenticate(user_details)
+    if not username:
+        return {"status": "failure", "notification": "Invalid credentials."}, None
+    
+    if not isinstance(since, str):
+        return {"status": "failure", "notification": "since must be an etag from get_tasks or get_changes."}, None
+    
+    if timeout is None:
+        timeout = LONG_POLL_TIMEOUT
+    if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or not 0 <= timeout <= LONG_POLL_MAX:
+        return {"status": "failure", "notification": f"timeout must be from 0 to {LONG_POLL_MAX} seconds."}, None
+    
+    subscription = broker.subscribe(username)
+    if subscription is None and broker.closed:
+        # Shutting down: answer now instead of holding the request open
+        return changes_response(username, since), None
+    if subscription is None:
+        return {"status": "failure", "notification": "Too many clients waiting; try again later."}, None
+    
+    # Subscribed before looking, so a change committed in between is not missed
+    response = changes_response(username, since)
+    if response["status"] != "success" or response["changes"] or timeout == 0:
+        subscription.close()
+        return response, None
+    return None, (subscription, timeout)
+
+# Server-sent events: one "data:" event per commit, {"etag": ..., "changes": [...]}
+# in the get_changes format, with the etag as the event id. A stream that falls
+# too far behind gets a "reset" event and is closed.
+def format_event(event, kind=None):
+    lines = []
+    if kind:
+        lines.append(f"event: {kind}")
+    elif "etag" in event:
+        lines.append(f"id: {event['etag']}")
+    lines.append("data: " + codec.dumps(event).decode())
+    return "\n".join(lines) + "\n\n"
+
+HEARTBEAT_EVENT = ": keep-alive\n\n"
+DROPPED_EVENT = format_event({"notification": "Too far behind; catch up with get_changes and reconnect."}, "reset")
+
+# Authenticate and subscribe an event stream. since (or Last-Event-ID) is the
+# last etag the client saw: anything it missed is sent first. Returns
+# (subscription, first chunks of the stream) or (None, (HTTP status, error body)).
+def open_event_stream(token, since=None):
+    username = token_user(token)
+    if not username:
+        return None, (401, {"status": "failure", "notification": "Invalid credentials."})
+    
+    subscription = broker.subscribe(username)
+    if subscription is None and broker.closed:
+        return None, (503, {"status": "failure", "notification": "The server is shutting down."})
+    if subscription is None:
+        return None, (503, {"status": "failure", "notification": "Too many open event streams; try again later."})
+    
+    chunks = [HEARTBEAT_EVENT]
+    if since:
+        response = changes_response(username, since)
+        if response["status"] == "reset":
+            chunks.append(format_event({"notification": response["notification"], "etag": response["etag"]}, "reset"))
+        elif response["changes"]:
+            chunks.append(format_event({"etag": response["etag"], "changes": response["changes"]}))
+    return subscription, chunks
+
+def event_stream(subscription, chunks):
+    with subscription:
+        yield from chunks
+        while True:
+            events = subscription.wait(SSE_HEARTBEAT)
+            if subscription.closed:
+                # broker.close(): the server is shutting down
+                return
+            if subscription.dropped:
+                yield DROPPED_EVENT
+                return
+            if not events:
+                yield HEARTBEAT_EVENT
+            for event in events:
+                yield format_event(event)
+
+# Bulk import: feed() the request body as it arrives and commit() whenever it
+# returns True, then finish() and commit() once more; result() is the response.
+# Each line holds one task object. Tasks get new ids, keep their "timestamp"
+# if they have one, and are committed in chunks of IMPORT_CHUNK_SIZE, so an
+# interrupted import keeps the chunks committed before it stopped.
+class TaskImport:
+    def __init__(self, username):
+        self.username = username
+        self.imported = 0
+        self.errors = []
+        self.failed = 0
+        self._pending = []
+        self._buffer = b""
+        self._line = 0
+        self._skipping = False  # inside a line longer than MAX_IMPORT_LINE_BYTES
+
+    def feed(self, data):
+        lines = (self._buffer + data).split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._add_line(line)
+        if len(self._buffer) > MAX_IMPORT_LINE_BYTES:
+            if not self._skipping:
+                self._fail(self._line + 1, "Line too long.")
+                self._skipping = True
+            self._buffer = b""
+        return len(self._pending) >= IMPORT_CHUNK_SIZE
+
+    def finish(self):
+        # A last line without a newline
+        if self._buffer.strip() or self._skipping:
+            self._add_line(self._buffer)
+        self._buffer = b""
+
+    def commit(self):
+        if not self._pending:
+            return
+        with store.transaction(self.username) as txn:
+            for task in self._pending:
+                txn.add_task(task)
+        self.imported += len(self._pending)
+        self._pending = []
+
+    def result(self):
+        return {
+            "status": "success",
+            "notification": f"{self.imported} tasks imported, {self.failed} lines skipped.",
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+    def _add_line(self, line):
+        self._line += 1
+        if self._skipping:
+            # The end of a line already reported as too long
+            self._skipping = False
+            return
+        if not line.strip():
+            return
+        try:
+            task = codec.loads(line)
+        except ValueError:
+            return self._fail(self._line, "Invalid JSON.")
+        if not isinstance(task, dict):
+            return self._fail(self._line, "Each line must be a task object.")
+        failure = invalid_fields(task)
+        if failure:
+            return self._fail(self._line, failure["notification"])
+        task.pop("id", None)
+        if not isinstance(task.get("timestamp"), str):
+            task["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._pending.append(task)
+
+    def _fail(self, line, notification):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({"line": line, "notification": notification})
+
+# Bulk export: the user's tasks as NDJSON, in list order, EXPORT_CHUNK_SIZE
+# tasks per chunk. Pages are read with a cursor, as in get_tasks, so the full
+# list is never copied and concurrent changes, in this process or another
+# worker, never make a task repeat or the export start over.
+def export_tasks(username):
+    after = None
+    while True:
+        tasks, after = store.get_page(username, None, None, after, EXPORT_CHUNK_SIZE)
+        if tasks:
+            yield b"".join(codec.dumps(task) + b"\n" for task in tasks)
+        if after is None:
+            return
+
+# The user a streaming request (/events, /import, /export) is for, from its session token
+def token_user(token):
+    return verify_token(token) if token else None
+
+# Login: exchange a username and password for a short-lived session token
+def login(user_details):
+    username = user_details.get("username")
+    if not auth_cache.verify(username, user_details.get("password")):
+        return {"status": "failure", "notification": "Invalid credentials."}
+    
+    return {"status": "success", "token": issue_token(username, TOKEN_TTL), "expires_in": TOKEN_TTL}
+
+# user_details from the body, with a "Authorization: Bearer <token>" header as an alternative
+def request_user_details(data, auth_header=None):
+    user_details = dict(data.get("user_details") or {})
+    auth_header = auth_header or ""
+    if auth_header.startswith("Bearer ") and "token" not in user_details:
+        user_details["token"] = auth_header[len("Bearer "):]
+    return user_details
+
+# The opaque tag from an If-None-Match header ("<etag>" or W/"<etag>")
+def parse_if_none_match(header):
+    if not header:
+        return None
+    header = header.strip()
+    if header.startswith("W/"):
+        header = header[2:]
+    return header.strip('"')
+
+# The actions of /task, in the order handle_task_request checks them
+ACTIONS = ("add_task", "edit_task", "remove_task", "get_tasks", "get_changes", "wait_changes", "batch")
+
+def request_action(data):
+    return next((action for action in ACTIONS if data.get(action)), "invalid")
+
+# handle_task_request, timed for /metrics, plus encoding the response:
+# returns (response body, encoded JSON)
+def serve_task_request(data, auth_header=None, if_none_match_header=None):
+    with metrics.request(request_action(data)) as timer:
+        body = handle_task_request(data, auth_header, if_none_match_header)
+        timer.status = body["status"]
+        with metrics.phase("serialize"):
+            payload = codec.dumps(body)
+    return body, payload
+
+# The body of a /task request -> the response body. Shared by the Flask app
+# below and the ASGI app in task_asgi.py.
+def handle_task_request(data, auth_header=None, if_none_match_header=None):
+    user_details = request_user_details(data, auth_header)
 
     # Check for action key in the request and process accordingly
     if data.get("add_task"):
-        return jsonify(add_task(data.get("task_details"), data.get("user_details")))
+        return add_task(data.get("task_details"), user_details)
     
     elif data.get("edit_task"):
-        return jsonify(
-            edit_task(
-                data.get("task_name"),
-                data.get("updated_task_details"),
-                data.get("user_details"),
-            )
+        return edit_task(
+            data.get("task_name"),
+            data.get("updated_task_details"),
+            user_details,
+            data.get("task_id"),
         )
     
     elif data.get("remove_task"):
-        return jsonify(remove_task(data.get("task_name"), data.get("user_details")))
+        return remove_task(data.get("task_name"), user_details, data.get("task_id"))
     
     elif data.get("get_tasks"):
-        return jsonify(get_tasks(data.get("user_details")))
+        return get_tasks(
+            user_details,
+            data.get("filters"),
+            data.get("limit"),
+            data.get("cursor"),
+            data.get("sort_by"),
+            data.get("if_none_match") or parse_if_none_match(if_none_match_header),
+        )
+    
+    elif data.get("get_changes"):
+        return get_changes(user_details, data.get("since"))
+    
+    elif data.get("wait_changes"):
+        return wait_changes(user_details, data.get("since"), data.get("timeout"))
+    
+    elif data.get("batch"):
+        return batch(data.get("operations"), user_details, bool(data.get("atomic")))
     
     else:
-        return jsonify({"status": "failure", "notification": "Invalid request."})
+        return {"status": "failure", "notification": "Invalid request."}
+
+# The body of a /login request -> the response body
+def handle_login_request(data):
+    return login(data.get("user_details") or {})
+
+@app.route("/login", methods=["POST"])
+def login_handler():
+    return jsonify(handle_login_request(request.json))
+
+@app.route("/task", methods=["POST"])
+def task_handler():
+    if_none_match = request.headers.get("If-None-Match")
+    body, payload = serve_task_request(request.json, request.headers.get("Authorization"), if_none_match)
+    if "etag" not in body:
+        return app.response_class(payload, mimetype="application/json")
+    
+    # A conditional HTTP request gets a bodiless 304; if_none_match in the body gets the JSON reply
+    if body["status"] == "not_modified" and if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(payload, mimetype="application/json")
+    response.headers["ETag"] = f'"{body["etag"]}"'
+    return response
+
+# Prometheus metrics (see metrics.py); 404 unless TASK_METRICS=1
+@app.route("/metrics", methods=["GET"])
+def metrics_handler():
+    if not metrics.ENABLED:
+        return jsonify({"status": "failure", "notification": "Metrics are disabled; set TASK_METRICS=1."}), 404
+    return app.response_class(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Streaming endpoints take the session token as "Authorization: Bearer" or
+# ?token= (browsers' EventSource cannot set headers)
+def request_token():
+    auth_header = request.headers.get("Authorization", "")
+    return auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else request.args.get("token")
+
+# Event stream: GET /events
+@app.route("/events", methods=["GET"])
+def events_handler():
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    subscription, error = open_event_stream(request_token(), since)
+    if subscription is None:
+        status, body = error
+        return jsonify(body), status
+    
+    return app.response_class(
+        event_stream(subscription, error),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Bulk import: POST /import with an NDJSON body (chunked transfer encoding is fine)
+@app.route("/import", methods=["POST"])
+def import_handler():
+    username = token_user(request_token())
+    if not username:
+        return jsonify({"status": "failure", "notification": "Invalid credentials."}), 401
+    
+    importer = TaskImport(username)
+    for data in iter(lambda: request.stream.read(64 * 1024), b""):
+        if importer.feed(data):
+            importer.commit()
+    importer.finish()
+    importer.commit()
+    return jsonify(importer.result())
+
+# Bulk export: GET /export streams the user's tasks as NDJSON
+@app.route("/export", methods=["GET"])
+def export_handler():
+    username = token_user(request_token())
+    if not username:
+        return jsonify({"status": "failure", "notification": "Invalid credentials."}), 401
+    
+    return app.response_class(export_tasks(username), mimetype="application/x-ndjson")
 
 if __name__ == "__main__":
+    # Turn SIGTERM into a normal exit so the atexit flush still runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f" * JSON codec: {codec.NAME}")
     app.run(debug=True)
@@ -0,0 +1,550 @@
+import bisect
+import collections
+import contextlib
+import itertools
+import logging
+import secrets
+import threading
+
+from storage import backfill_task_ids, new_task_id
+from task_index import TaskIndex, matches, sort_key
+
+logger = logging.getLogger(__name__)
+
+# Version of a user whose tasks have not been read yet
+_NOT_LOADED = object()
+
+
+class UserTasks:
+    """One user's tasks, in list order, indexed by id, by name and for filtering.
+
+    ``tasks`` maps task id -> task and preserves list order, so looking up or
+    removing a task is O(1) while iteration still follows the order tasks were
+    added in.  Each task also gets a position key, one past the highest in use
+    when it is added, and ``by_name`` maps each name to the sorted
+    ``(position, id)`` pairs of the tasks carrying it.  Positions depend only
+    on the tasks, not on the process, so every worker loading the same list
+    numbers it the same way.
+
+    Duplicate names are allowed.  A name always refers to the *oldest* task
+    with that name (the first one in the list), which is what a scan of the
+    list would find.
+
+    ``index`` holds the secondary indexes used by ``query()`` (see task_index.py).
+    ``version`` is set by the store whenever the tasks change (see
+    ``TaskStore.version``).  ``changes`` logs ``(version, task id)`` for the
+    most recent changes; it is complete for every version from
+    ``changes_from`` on, so ``changed_since()`` can answer delta requests.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.positions = {}
+        self.by_name = {}
+        self.index = TaskIndex()
+        self.version = 0
+        self.changes = collections.deque()
+        self.changes_from = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def next_position(self):
+        """Return the position key for a task added at the end of the list."""
+        ordering = self.index.orderings[None]
+        return ordering[-1][0] + 1 if ordering else 0
+
+    def values(self):
+        # The position ordering, not dict order: a task restored by a rollback keeps its place
+        return [self.tasks[task_id] for _, task_id in self.index.orderings[None]]
+
+    def find(self, name):
+        """Return the id of the oldest task called ``name``, or None."""
+        entries = self.by_name.get(name)
+        return entries[0][1] if entries else None
+
+    def query(self, filters, sort_by=None, after=None, limit=None):
+        """Return ``(tasks, last)`` for the tasks matching parsed ``filters``.
+
+        Tasks come in ``sort_by`` order (see task_index.SORT_FIELDS), starting
+        after the ``(sort key, id)`` entry ``after``.  At most ``limit`` tasks
+        are returned; ``last`` is the entry of the last one when more remain,
+        else None.  Only the requested page is materialized: the pre-sorted
+        ordering is walked from the cursor, or, for a selective filter, just
+        the candidate tasks are sorted.
+        """
+        if not filters and sort_by is None and after is None and limit is None:
+            return self.values(), None
+        if sort_by is None and after is not None and after[1] in self.positions:
+            # Seek from where the cursor's task is here, should its position differ (e.g. in another worker)
+            after = (self.positions[after[1]], after[1])
+        candidates = self.index.candidates(filters, len(self.tasks)) if filters else None
+        if candidates is not None:
+            ordering = sorted(
+                (sort_key(sort_by, self.tasks[task_id], self.positions[task_id]), task_id)
+                for task_id in candidates
+                if matches(self.tasks[task_id], filters)
+            )
+            filters = None  # already applied
+        else:
+            ordering = self.index.orderings[sort_by]
+        start = bisect.bisect_right(ordering, after) if after is not None else 0
+        page = []
+        for position in range(start, len(ordering)):
+            entry = ordering[position]
+            task = self.tasks[entry[1]]
+            if filters and not matches(task, filters):
+                continue
+            if limit is not None and len(page) == limit:
+                return page, last
+            page.append(task)
+            last = entry
+        return page, None
+
+    def changed_since(self, version):
+        """Return the ids of tasks changed after ``version``, oldest change first.
+
+        Returns None if the log no longer goes back that far.
+        """
+        if version < self.changes_from:
+            return None
+        task_ids = {}
+        for change_version, task_id in reversed(self.changes):
+            if change_version <= version:
+                break
+            task_ids.setdefault(task_id, None)
+        return list(reversed(task_ids))
+
+    def record_changes(self, version, task_ids, limit):
+        """Log that ``task_ids`` changed at ``version``, keeping at most ``limit`` entries."""
+        self.version = version
+        self.changes.extend((version, task_id) for task_id in task_ids)
+        while len(self.changes) > limit:
+            # Changes made at or before this version are no longer all in the log
+            self.changes_from = self.changes.popleft()[0]
+
+    def add(self, position, task):
+        _check_keys(task)
+        task_id = task["id"]
+        self.tasks[task_id] = task
+        self.positions[task_id] = position
+        self._index_name(task_id, task.get("name"))
+        self.index.add(task_id, task, position)
+
+    def replace(self, task):
+        _check_keys(task)
+        task_id = task["id"]
+        old_task = self.tasks[task_id]
+        self.tasks[task_id] = task
+        if task.get("name") != old_task.get("name"):
+            self._unindex_name(task_id, old_task.get("name"))
+            self._index_name(task_id, task.get("name"))
+        self.index.remove(task_id, old_task, self.positions[task_id])
+        self.index.add(task_id, task, self.positions[task_id])
+
+    def remove(self, task_id):
+        task = self.tasks.pop(task_id)
+        self._unindex_name(task_id, task.get("name"))
+        self.index.remove(task_id, task, self.positions[task_id])
+        del self.positions[task_id]
+
+    def _index_name(self, task_id, name):
+        bisect.insort(self.by_name.setdefault(name, []), (self.positions[task_id], task_id))
+
+    def _unindex_name(self, task_id, name):
+        entries = self.by_name[name]
+        if len(entries) == 1:
+            del self.by_name[name]
+        else:
+            del entries[bisect.bisect_left(entries, (self.positions[task_id], task_id))]
+
+
+# Raises TypeError for a task whose name or priority cannot be an index key. Checked
+# before a task is stored, so a bad task leaves the tasks and their indexes untouched.
+def _check_keys(task):
+    hash(task.get("name"))
+    hash(task.get("priority"))
+
+
+class TaskStore:
+    """Process-resident copy of the task data with write-behind persistence.
+
+    The data is loaded from ``repository`` (see storage.py) once when the store
+    is created and every read is served from memory.  Mutations are
+    acknowledged immediately and written back by a background thread every
+    ``flush_interval_ms`` milliseconds, or as soon as ``flush_every`` mutations
+    are pending.  With ``flush_every=1`` the store is write-through: the
+    mutating call returns only after the data is on disk.  ``close()`` stops
+    the flusher and writes any pending changes.
+
+    Tasks are addressed by their id (see ``storage.new_task_id``); tasks
+    loaded without one are given an id and saved back straight away.  Lookups
+    by id and by name go through per-user indexes (see ``UserTasks``), so edits
+    and removals are constant time regardless of list length.
+
+    Each user has a lock of their own, so requests for different users never
+    wait for each other.  With a lazy repository (see storage.py) each user's
+    tasks are read the first time they are needed rather than at startup.
+
+    ``version(username)`` changes whenever the user's tasks do, so clients
+    can tell cheaply whether what they fetched earlier is still current, and
+    ``changes_since(username, version)`` returns just what changed after it
+    (from a per-user log of the last ``change_log_size`` changes).
+
+    Set ``shared`` when other processes (more workers, the desktop app) write
+    the same storage.  The store is then write-through, each transaction holds
+    the repository's cross-process lock for its user, and a user's tasks are
+    reloaded whenever ``repository.version(username)`` shows someone else
+    changed them.
+    """
+
+    def __init__(self, repository, flush_interval_ms=500, flush_every=100, shared=False, change_log_size=1000):
+        self.repository = repository
+        self.shared = shared
+        self.change_log_size = change_log_size
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_every = 1 if shared else max(1, flush_every)
+
+        # Versions are "<epoch>.<counter>": the random epoch tells this store's counters apart
+        # from those of an earlier run or another process, whose counters may coincide.
+        # A version from another worker is therefore never recognised; the client refetches.
+        self._epoch = secrets.token_hex(4)
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()        # guards self._users / self._user_locks / self._ops
+        self._flush_lock = threading.Lock()  # serializes writes to the repository
+        self._users = {}
+        self._user_locks = {}
+        self._ops = []
+        self._versions = {}  # username -> repository version their tasks were loaded at
+        self._commit_listeners = []
+        self._wake = threading.Event()
+        self._closed = False
+
+        # Users missing from self._versions are at this version (or not loaded yet, for a lazy repository)
+        self._initial_version = _NOT_LOADED
+        if not repository.lazy:
+            with repository.lock():
+                self._load_all()
+
+        self._flusher = None
+        if self.flush_every > 1 and flush_interval_ms > 0:
+            self._flusher = threading.Thread(target=self._run_flusher, name="task-store-flusher", daemon=True)
+            self._flusher.start()
+
+    # Reads
+    def get_tasks(self, username, filters=None):
+        """Return the user's tasks matching parsed ``filters`` (see task_index.py), in list order."""
+        return self.get_page(username, filters)[0]
+
+    def get_page(self, username, filters=None, sort_by=None, after=None, limit=None):
+        """Return one page of the user's tasks and the cursor entry for the next; see ``UserTasks.query``."""
+        self._current(username)
+        with self._user_lock(username):
+            user = self._users.get(username)
+            return user.query(filters, sort_by, after, limit) if user else ([], None)
+
+    def get_task(self, username, task_id):
+        """Return the task with id ``task_id``, or None."""
+        self._current(username)
+        with self._user_lock(username):
+            user = self._users.get(username)
+            return user.tasks.get(task_id) if user else None
+
+    def find_task(self, username, task_name):
+        """Return the id of the user's oldest task named ``task_name``, or None."""
+        self._current(username)
+        with self._user_lock(username):
+            user = self._users.get(username)
+            return user.find(task_name) if user else None
+
+    def has_tasks(self, username):
+        """Return True if the user has at least one task."""
+        self._current(username)
+        with self._user_lock(username):
+            return bool(self._users.get(username))
+
+    def version(self, username):
+        """Return an opaque string that changes whenever the user's tasks change."""
+        self._current(username)
+        with self._user_lock(username):
+            user = self._users.get(username)
+            return f"{self._epoch}.{user.version if user else 0}"
+
+    def changes_since(self, username, version):
+        """Return ``(changes, current version)`` for what changed after ``version``.
+
+        ``changes`` lists, in the order they last changed, the current state of
+        every task added or edited since, and ``{"id": ..., "deleted": True}``
+        for every task removed since.  It is None when ``version`` is not one
+        of this store's versions or is older than the change log reaches;
+        the client then has to fetch the full list again.
+        """
+        self._current(username)
+        with self._user_lock(username):
+            user = self._users.get(username)
+            current = f"{self._epoch}.{user.version if user else 0}"
+            epoch, _, counter = version.partition(".") if isinstance(version, str) else ("", "", "")
+            if epoch != self._epoch or not counter.isdigit():
+                return None, current
+            if not user:
+                # Nothing was ever recorded for this user in this store
+                return ([] if int(counter) == 0 else None), current
+            task_ids = user.changed_since(int(counter))
+            if task_ids is None:
+                return None, current
+            changes = [user.tasks.get(task_id) or {"id": task_id, "deleted": True} for task_id in task_ids]
+            return changes, current
+
+    # Mutations
+    @contextlib.contextmanager
+    def transaction(self, username):
+        """Apply several mutations of one user's tasks as a unit.
+
+        Yields a ``Transaction``.  Its changes are persisted together, in one
+        write, once the block ends; ``rollback()`` (or an exception) undoes all
+        of them instead.  A shared store writes them before the block returns,
+        and undoes them if the write fails.  Other writers for the same user (and, for a shared
+        store, every writer of the repository) wait until the block ends, so
+        keep it short.
+        """
+        with self.repository.lock(username) if self.shared else contextlib.nullcontext():
+            self._current(username)
+            with self._user_lock(username):
+                txn = Transaction(self, username)
+                try:
+                    yield txn
+                except BaseException:
+                    txn.rollback()
+                    raise
+                if txn.ops and self.shared:
+                    # Write-through of just this transaction's records, under just this
+                    # user's repository lock.  Going through flush() would write other
+                    # users' records too, which needs their locks (one per shard for
+                    # sharded storage) while other transactions hold them: a deadlock.
+                    try:
+                        self.repository.persist(txn.ops)
+                    except BaseException:
+                        txn.rollback()
+                        raise
+                    # Memory and storage agree again; our own write is not a reason to reload
+                    self._versions[username] = self.repository.version(username)
+                if txn.ops:
+                    user = txn._user()
+                    changed_ids = list(dict.fromkeys(txn.changed_ids()))
+                    user.record_changes(next(self._clock), changed_ids, self.change_log_size)
+                    if not self.shared:
+                        with self._lock:
+                            self._ops.extend(txn.ops)
+                    # Still under the user's lock, so listeners see each user's commits in order
+                    self._notify_commit(username, user, changed_ids)
+            if txn.ops and not self.shared:
+                self._after_mutation()
+
+    def add_commit_listener(self, listener):
+        """Call ``listener(username, version, changes)`` after every committed transaction.
+
+        ``changes`` has the same form as in ``changes_since``.  Listeners run
+        while the user's lock is held, so they must be quick and must not call
+        back into the store.
+        """
+        self._commit_listeners.append(listener)
+
+    def add_task(self, username, task):
+        """Append a task to the user's list under a new id; return the id."""
+        with self.transaction(username) as txn:
+            return txn.add_task(task)
+
+    def edit_task(self, username, task_id, updated_task_details):
+        """Update the task with id ``task_id``; return False if there is none.
+
+        The id itself cannot be changed.
+        """
+        with self.transaction(username) as txn:
+            return txn.edit_task(task_id, updated_task_details)
+
+    def remove_task(self, username, task_id):
+        """Remove the task with id ``task_id``; return False if there is none."""
+        with self.transaction(username) as txn:
+            return txn.remove_task(task_id)
+
+    # Persistence
+    def flush(self):
+        """Write pending changes to the repository now."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._ops:
+                    return
+                ops = self._ops
+                self._ops = []
+            try:
+                self.repository.persist(ops)
+            except Exception:
+                with self._lock:
+                    self._ops[:0] = ops
+                raise
+
+    def close(self):
+        """Stop the background flusher, write any pending changes and close the repository."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        self.repository.close()
+
+    def _notify_commit(self, username, user, changed_ids):
+        if not self._commit_listeners:
+            return
+        version = f"{self._epoch}.{user.version}"
+        changes = [user.tasks.get(task_id) or {"id": task_id, "deleted": True} for task_id in changed_ids]
+        for listener in self._commit_listeners:
+            try:
+                listener(username, version, changes)
+            except Exception:
+                logger.exception("Commit listener %r failed", listener)
+
+    def _user_lock(self, username):
+        with self._lock:
+            lock = self._user_locks.get(username)
+            if lock is None:
+                lock = self._user_locks[username] = threading.Lock()
+            return lock
+
+    def _current(self, username):
+        # Make sure the user's tasks are loaded and, for a shared store, up to date.
+        # The repository lock is taken before the user's lock, as transactions do.
+        if self._stale(username):
+            with self.repository.lock(username), self._user_lock(username):
+                if self._stale(username):
+                    self._load_user(username)
+
+    def _stale(self, username):
+        version = self._versions.get(username, self._initial_version)
+        if version is _NOT_LOADED:
+            return True
+        return self.shared and self.repository.version(username) != version
+
+    def _load_all(self):
+        # Called with the repository lock held
+        data = self.repository.load()
+        backfilled = backfill_task_ids(data)
+        if backfilled:
+            self.repository.persist(
+                [{"op": "replace_user", "user": username, "tasks": data[username]} for username in backfilled]
+            )
+        with self._lock:
+            for username, tasks in data.items():
+                self._users[username] = self._build_user(tasks)
+        self._initial_version = self.repository.version()
+
+    def _load_user(self, username):
+        # Called with the repository lock and the user's lock held
+        data = {username: self.repository.load_user(username)}
+        if backfill_task_ids(data):
+            self.repository.persist([{"op": "replace_user", "user": username, "tasks": data[username]}])
+        user = self._build_user(data[username], self._users.get(username))
+        with self._lock:
+            self._users[username] = user
+        self._versions[username] = self.repository.version(username)
+
+    def _build_user(self, tasks, previous=None):
+        user = UserTasks()
+        for task in tasks:
+            # Tasks known from before a reload keep their positions, so cursors stay valid
+            position = previous.positions.get(task["id"]) if previous else None
+            user.add(user.next_position() if position is None else position, task)
+        # Changes from before the load are unknown
+        user.version = user.changes_from = next(self._clock)
+        return user
+
+    def _after_mutation(self):
+        if self._flusher is None:
+            self.flush()
+        elif len(self._ops) >= self.flush_every:
+            self._wake.set()
+
+    def _run_flusher(self):
+        interval = self.flush_interval_ms / 1000.0
+        while not self._closed:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush tasks; will retry")
+
+
+class Transaction:
+    """Mutations of one user's tasks, made while holding that user's lock.
+
+    Created by ``TaskStore.transaction``.  The mutation records are collected
+    in ``ops`` and handed to the store when the transaction ends.  Each change
+    also records how to undo itself, so ``rollback()`` can restore the user's
+    tasks (including their order) and drop the records.
+    """
+
+    def __init__(self, store, username):
+        self.store = store
+        self.username = username
+        self.ops = []
+        self._undo = []
+
+    def _user(self, create=False):
+        with self.store._lock:
+            if create:
+                return self.store._users.setdefault(self.username, UserTasks())
+            return self.store._users.get(self.username)
+
+    def has_tasks(self):
+        return bool(self._user())
+
+    def find_task(self, task_name):
+        user = self._user()
+        return user.find(task_name) if user else None
+
+    def get_task(self, task_id):
+        user = self._user()
+        return user.tasks.get(task_id) if user else None
+
+    def add_task(self, task):
+        user = self._user(create=True)
+        task = {**task, "id": new_task_id()}
+        user.add(user.next_position(), task)
+        self.ops.append({"op": "add", "user": self.username, "task": task})
+        self._undo.append(lambda: user.remove(task["id"]))
+        return task["id"]
+
+    def edit_task(self, task_id, updated_task_details):
+        user = self._user()
+        if not user or task_id not in user.tasks:
+            return False
+        changes = {field: value for field, value in updated_task_details.items() if field != "id"}
+        old_task = user.tasks[task_id]
+        # Copy-on-write so snapshots handed to readers never change underneath them
+        user.replace({**old_task, **changes})
+        self.ops.append({"op": "edit", "user": self.username, "id": task_id, "changes": changes})
+        self._undo.append(lambda: user.replace(old_task))
+        return True
+
+    def remove_task(self, task_id):
+        user = self._user()
+        if not user or task_id not in user.tasks:
+            return False
+        old_task = user.tasks[task_id]
+        position = user.positions[task_id]
+        user.remove(task_id)
+        self.ops.append({"op": "remove", "user": self.username, "id": task_id})
+        self._undo.append(lambda: user.add(position, old_task))
+        return True
+
+    def changed_ids(self):
+        """Return the ids of the tasks this transaction changed."""
+        return [op["task"]["id"] if op["op"] == "add" else op["id"] for op in self.ops]
+
+    def rollback(self):
+        """Undo every change made so far in this transaction."""
+        while self._undo:
+            self._undo.pop()()
+        self.ops.clear()
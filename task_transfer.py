@@ -0,0 +1,92 @@
+import argparse
+import getpass
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.request
+
+import codec
+
+# Bulk import / export of a user's tasks as NDJSON (one task per line) through
+# the service's /import and /export endpoints, e.g.
+#   python task_transfer.py export tasks.ndjson --username user123
+#   python task_transfer.py import tasks.ndjson --username user123
+# Use "-" for standard output / input. Both directions stream, so files of any
+# size take constant memory here and on the server.
+
+DEFAULT_URL = "http://127.0.0.1:5000"
+
+# Bytes copied at a time
+CHUNK_BYTES = 64 * 1024
+
+
+def login(url, username, password):
+    """Return a session token for ``username``; raises SystemExit on failure."""
+    body = codec.dumps({"user_details": {"username": username, "password": password}})
+    request = urllib.request.Request(f"{url}/login", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        result = codec.loads(response.read())
+    if result.get("status") != "success":
+        raise SystemExit(f"Login failed: {result.get('notification')}")
+    return result["token"]
+
+
+def export_tasks(url, token, output):
+    request = urllib.request.Request(f"{url}/export", headers={"Authorization": f"Bearer {token}"})
+    with urllib.request.urlopen(request) as response:
+        shutil.copyfileobj(response, output, CHUNK_BYTES)
+
+
+def import_tasks(url, token, source):
+    """Upload ``source`` (a binary file) and return the server's report."""
+    # A file body without a length is sent with chunked transfer encoding, a block at a time
+    request = urllib.request.Request(
+        f"{url}/import",
+        data=source,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return codec.loads(response.read())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export a user's tasks as NDJSON.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help='NDJSON file ("-" for standard input / output)')
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"task service address (default: {DEFAULT_URL})")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", help="default: $TASK_PASSWORD, else prompt")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    url = args.url.rstrip("/")
+    password = args.password or os.environ.get("TASK_PASSWORD") or getpass.getpass()
+    try:
+        token = login(url, args.username, password)
+        if args.command == "export":
+            if args.file == "-":
+                export_tasks(url, token, sys.stdout.buffer)
+            else:
+                with open(args.file, "wb") as output:
+                    export_tasks(url, token, output)
+            return 0
+
+        if args.file == "-":
+            report = import_tasks(url, token, sys.stdin.buffer)
+        else:
+            with open(args.file, "rb") as source:
+                report = import_tasks(url, token, source)
+    except (urllib.error.URLError, OSError) as error:
+        raise SystemExit(f"{args.command} failed: {error}")
+
+    print(report.get("notification"), file=sys.stderr)
+    for error in report.get("errors", []):
+        print(f"  line {error['line']}: {error['notification']}", file=sys.stderr)
+    return 0 if report.get("status") == "success" and not report.get("failed") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())